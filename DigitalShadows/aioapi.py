@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import aiohttp
+import asyncio
+import json
+import ssl
+import sys
+import inspect
+import threading
+import logging
+
+from .api import (DigitalShadowsApi, RETRY_STATUSES, incidents_query, intel_incidents_query,
+                  iocs_query, databreach_records_query)
+
+class RequestError(Exception):
+    pass
+
+class Response():
+
+    def __init__(self, status_code, headers, content):
+
+        """
+        Response returned by AsyncDigitalShadowsApi, with the attributes of
+        requests.Response used by ds2th
+        :type status_code: int
+        :type headers: dict
+        :type content: bytes
+        """
+
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+class AsyncDigitalShadowsApi(DigitalShadowsApi):
+
+    asynchronous = True
+
+    def __init__(self, config, pool=None):
+
+        """
+        Asyncio Python API for DigitalShadows, with the methods of
+        DigitalShadowsApi as coroutines. They run in an event loop started in
+        a background thread: use run() and iterate() to call them from
+        synchronous code.
+        :param config: Digital Shadows configuration from config.py
+        :type config: dict
+        :param pool: client of another account whose event loop and pooled
+            connections are shared, with a session of its own for the
+            credentials and cookies
+        :type pool: AsyncDigitalShadowsApi
+        """
+
+        super().__init__(config, pool)
+        self.pool_size = config.get('pool_maxsize', 10)
+        self.max_in_flight = config.get('max_in_flight', 8)
+        self.requests_sent = 0
+        if pool is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name='DigitalShadows-asyncio', daemon=True)
+            self.thread.start()
+            self.connector = self.run(self.connect())
+        else:
+            self.loop = pool.loop
+            self.thread = pool.thread
+            self.connector = pool.connector
+        self.aiosession = self.run(self.open())
+
+    async def connect(self):
+
+        """
+        :return: connector pooling up to `pool_maxsize` connections
+        :rtype: aiohttp.TCPConnector
+        """
+
+        if self.verify is False:
+            context = False
+        else:
+            context = ssl.create_default_context(cafile=self.verify if isinstance(self.verify, str) else None)
+        return aiohttp.TCPConnector(limit=self.pool_size, ssl=context, force_close='Connection' in self.headers)
+
+    async def open(self):
+
+        """
+        :return: aiohttp session of this account over the pooled connector,
+            the number of its concurrent requests is capped to `max_in_flight`
+        :rtype: aiohttp.ClientSession
+        """
+
+        self.aio_in_flight = asyncio.Semaphore(self.max_in_flight)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        return aiohttp.ClientSession(connector=self.connector, connector_owner=False, headers=self.headers,
+                                     timeout=timeout, auth=aiohttp.BasicAuth(self.key, self.secret))
+
+    async def shutdown(self):
+
+        """
+        Close the session, and the connector unless it belongs to `pool`
+        """
+
+        await self.aiosession.close()
+        if self.pool is None:
+            # a coroutine only with recent aiohttp versions
+            closed = self.connector.close()
+            if inspect.isawaitable(closed):
+                await closed
+
+    def run(self, coro):
+
+        """
+        Run a coroutine in the event loop and wait for its result. Must not
+        be called from the event loop itself.
+        """
+
+        try:
+            return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        except RequestError as e:
+            sys.exit(str(e))
+
+    def iterate(self, agen):
+
+        """
+        Iterate over an async generator run in the event loop. Must not be
+        called from the event loop itself.
+        :param agen: async generator
+        :return: items of `agen`
+        :rtype: generator
+        """
+
+        try:
+            while True:
+                try:
+                    item = self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            asyncio.run_coroutine_threadsafe(agen.aclose(), self.loop).result()
+
+    def close(self):
+
+        """
+        Close the pooled connections and stop the event loop, unless they
+        belong to `pool`
+        """
+
+        self.run(self.shutdown())
+        if self.pool is None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        super().close()
+
+    def connection_stats(self):
+
+        """
+        :return: number of requests sent
+        :rtype: dict
+        """
+
+        return {'requests': self.requests_sent}
+
+    def proxy(self, req):
+        return self.proxies.get('https' if req.startswith('https') else 'http') or None
+
+    async def throttle(self):
+
+        """
+        Wait until the rate limit allows a request
+        """
+
+        delay = self.limiter.reserve()
+        while delay:
+            await asyncio.sleep(delay)
+            delay = self.limiter.reserve()
+
+    async def request(self, method, req, data=None, headers=None):
+
+        """
+        Send a request to DigitalShadows, with the rate limit and retries of
+        DigitalShadowsApi.request()
+        :param method: HTTP method
+        :type method: str
+        :param req: url
+        :type req: str
+        :return: response
+        :rtype: Response
+        """
+
+        attempt = 0
+        while True:
+            await self.throttle()
+            try:
+                async with self.aio_in_flight, self.aiosession.request(method, req, data=data, headers=headers,
+                                                                       proxy=self.proxy(req)) as resp:
+                    response = Response(resp.status, resp.headers, await resp.read())
+                self.requests_sent += 1
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff(attempt)
+                logging.debug("request(): {} {} failed ({}), retry in {:.1f}s".format(method, req, e, delay))
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                if response.status_code == 429:
+                    self.limiter.pause(delay)
+                logging.debug("request(): {} {} returned {}, retry in {:.1f}s".format(method, req, response.status_code, delay))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def send(self, method, req, payload=None):
+
+        """
+        :return: response
+        :rtype: Response
+        """
+
+        try:
+            return await self.request(method, req, data=payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RequestError("Error: {}".format(e))
+
+    async def fetch(self, method, req, payload=None):
+
+        """
+        :return: response
+        :rtype: dict
+        """
+
+        resp = await self.send(method, req, payload)
+        try:
+            if resp.status_code == 200:
+                return self.response("success", resp.json())
+            else:
+                return self.response("failure", resp.json())
+        except ValueError as e:
+            raise RequestError("Error: {}".format(e))
+
+    async def paginate(self, find, *args, **kwargs):
+
+        """
+        Walk all the pages of a DigitalShadows search until `total` is reached
+        :param find: paginated coroutine of this class, like find_incidents
+        :param size: page size, `page_size` from config by default
+        :type size: int
+        :return: one response per page, stops after the first failure
+        :rtype: async generator
+        """
+
+        size = kwargs.pop('size', None) or self.page_size
+        offset = 0
+        while True:
+            response = await find(*args, offset=offset, size=size, **kwargs)
+            yield response
+            if response.get('status') != "success":
+                return
+            data = response.get('data')
+            count = len(data.get('content', []))
+            offset += count
+            # a page shorter than `size` is not the last one while `total` is not
+            # reached: the server may cap the page size
+            if count == 0 or offset >= data.get('total', 0):
+                return
+
+    async def revalidated(self, req):
+
+        """
+        Send a conditional request, see DigitalShadowsApi.revalidate()
+        :return: response
+        :rtype: dict
+        """
+
+        try:
+            resp = await self.request('GET', req, headers=self.conditions(req))
+            return self.revalidate(req, resp.status_code, resp.headers, resp.content)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise RequestError("Error: {}".format(e))
+
+    async def get_incident(self, id, fulltext='true'):
+        req = self.url + '/api/incidents/{}'.format(id)
+        return await self.revalidated(req)
+
+    async def get_intel_incident(self, id, fulltext='true'):
+        req = self.url + '/api/intel-incidents/{}?fulltext='.format(id) + fulltext
+        return await self.revalidated(req)
+
+    async def find_incidents(self, since, property='published', direction='ASCENDING', offset=0, size=50):
+        req = self.url + '/api/incidents/find'
+        payload = json.dumps(incidents_query(since, property, direction, offset, size))
+        return await self.fetch('POST', req, payload)
+
+    async def find_intel_incidents(self, since, property='verified', direction='ASCENDING', offset=0, size=50):
+        req = self.url + '/api/intel-incidents/find'
+        payload = json.dumps(intel_incidents_query(since, property, direction, offset, size))
+        return await self.fetch('POST', req, payload)
+
+    async def get_intel_incident_iocs(self, id):
+        req = "{}/api/intel-incidents/{}/iocs".format(self.url, id)
+        return await self.send('POST', req, json.dumps(iocs_query()))
+
+    async def get_screenshot(self, id):
+        req = "{}/api/external/downloads/{}".format(self.url, id)
+        return await self.send('GET', req)
+
+    async def get_thumbnail(self, id):
+        req = "{}/api/thumbnails/{}".format(self.url, id)
+        return await self.send('GET', req)
+
+    async def save(self, req, path):
+
+        """
+        DigitalShadowsApi.save(): stream a file from DigitalShadows to disk
+        :return: content type, None if the file could not be downloaded
+        :rtype: str
+        """
+
+        await self.throttle()
+        try:
+            async with self.aio_in_flight, self.aiosession.get(req, proxy=self.proxy(req)) as resp:
+                self.requests_sent += 1
+                if resp.status != 200:
+                    logging.debug("save(): {} returned {}".format(req, resp.status))
+                    return None
+                with open(path, 'wb') as f:
+                    async for chunk in resp.content.iter_chunked(64 * 1024):
+                        f.write(chunk)
+                return resp.headers.get('Content-Type', 'application/octet-stream')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RequestError("Error: {}".format(e))
+
+    async def save_screenshot(self, id, path):
+        return await self.save("{}/api/external/downloads/{}".format(self.url, id), path)
+
+    async def save_thumbnail(self, id, path):
+        return await self.save("{}/api/thumbnails/{}".format(self.url, id), path)
+
+    async def get_databreach(self, id):
+        req = "{}/api/data-breach/{}".format(self.url, id)
+        return await self.send('GET', req)
+
+    async def get_databreach_records(self, id, offset=0, size=1000):
+        req = "{}/api/data-breach/{}/records".format(self.url, id)
+        payload = json.dumps(databreach_records_query(offset, size))
+        return await self.fetch('POST', req, payload)
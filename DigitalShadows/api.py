@@ -3,17 +3,139 @@
 
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import sys
+import threading
+import time
+import random
+import logging
+from email.utils import parsedate_to_datetime
+
+from .ratelimit import TokenBucket
+from .stream import ContentStream, ijson
+from .cache import ResponseCache
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+def incidents_query(since, property, direction, offset, size):
+
+    """
+    :return: body of the incidents search
+    :rtype: dict
+    """
+
+    return {
+      "filter": {
+        "severities": [],
+        "tags": [],
+        "tagOperator": "AND",
+        "dateRange": since,
+        "dateRangeField": property,
+        "types": [],
+        "withFeedback": True,
+        "withoutFeedback": True,
+        "alerted": False,
+        "withTakedown": True,
+        "withoutTakedown": True,
+        "withContentRemoved": True,
+        "withoutContentRemoved": True,
+        "statuses": [
+          "UNREAD",
+          "READ"
+        ],
+        "repostedCredentials": []
+      },
+      "sort": {
+        "property": "date",
+        "direction": direction
+      },
+      "pagination": {
+        "size": size,
+        "offset": offset
+      },
+      "subscribed": True
+    }
+
+def intel_incidents_query(since, property, direction, offset, size):
+
+    """
+    :return: body of the intel-incidents search
+    :rtype: dict
+    """
+
+    return {
+      "filter": {
+        "severities": [],
+        "tags": [],
+        "tagOperator": "AND",
+        "dateRange": since,
+        "dateRangeField": "published",
+        "types": [],
+        "withFeedback": True,
+        "withoutFeedback": True
+      },
+      "sort": {
+        "property": property,
+        "direction": direction
+      },
+      "pagination": {
+        "size": size,
+        "offset": offset
+      }
+    }
+
+def iocs_query():
+
+    """
+    :return: body of the intel-incident IOCs search
+    :rtype: dict
+    """
+
+    return {
+        "filter": {},
+        "sort": {
+            "property": "value",
+            "direction": "ASCENDING"
+        }
+    }
+
+def databreach_records_query(offset, size):
+
+    """
+    :return: body of the databreach records search
+    :rtype: dict
+    """
+
+    return {
+      "filter": {
+        "published": "ALL",
+        "domainNames": [],
+        "reviewStatuses": []
+      },
+      "sort": {
+        "property": "username",
+        "direction": "ASCENDING"
+      },
+      "pagination": {
+        "size": size,
+        "offset": offset
+      }
+    }
 
 class DigitalShadowsApi():
 
-    def __init__(self, config):
+    asynchronous = False
+
+    def __init__(self, config, pool=None):
         
         """
         Python API for DigitalShadows
         :param config: Digital Shadows configuration from config.py
         :type config: dict
+        :param pool: client of another account whose pooled connections are
+            shared, with a session of its own for the credentials and cookies
+        :type pool: DigitalShadowsApi
         """
 
         self.url = config['url']
@@ -21,12 +143,190 @@ class DigitalShadowsApi():
         self.secret = config['ds_secret']
         self.proxies = config['proxies']
         self.verify = config['verify']
+        self.page_size = config.get('page_size', 50)
         self.headers = {
             'Content-Type': 'application/vnd.polaris-v38+json',
             'Accept': 'application/vnd.polaris-v38+json'
         }
+        if not config.get('keep_alive', True):
+            self.headers['Connection'] = 'close'
         self.auth = requests.auth.HTTPBasicAuth(username=self.key,
                                                 password=self.secret)
+        self.timeout = (config.get('connect_timeout', 10),
+                        config.get('read_timeout', 60))
+
+        # One pooled session shared by every call, so that TCP/TLS connections
+        # (and proxy tunnels) are kept alive and reused between requests
+        self.pool = pool
+        self.session = requests.Session()
+        if pool is None:
+            self.adapter = HTTPAdapter(pool_connections=config.get('pool_connections', 10),
+                                       pool_maxsize=config.get('pool_maxsize', 10))
+        else:
+            self.adapter = pool.adapter
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        # cap the number of concurrent requests sent to the DigitalShadows host
+        self.in_flight = threading.BoundedSemaphore(config.get('max_in_flight', 8))
+        self.limiter = TokenBucket(config.get('rate_limit', 0), config.get('rate_burst', 10))
+        self.retries = config.get('retries', 5)
+        self.backoff_factor = config.get('backoff_factor', 1)
+        self.backoff_max = config.get('backoff_max', 60)
+        # decode `content` of big pages while they are downloaded
+        self.streaming = config.get('stream_json', False)
+        if self.streaming and ijson is None:
+            logging.debug("DigitalShadowsApi(): ijson is not installed, responses are not streamed")
+            self.streaming = False
+        # incidents fetched by ID are revalidated with conditional requests
+        self.cache = None
+        if config.get('response_cache_file'):
+            self.cache = ResponseCache(config.get('response_cache_file'), config.get('index_retention', 30))
+
+    def request(self, method, req, **kwargs):
+
+        """
+        Send a request to DigitalShadows through the pooled session, at the
+        rate allowed by `rate_limit`. Connection errors, timeouts, 429 and 5xx
+        responses are retried `retries` times with exponential backoff and
+        jitter, honoring `Retry-After`.
+        :param method: HTTP method
+        :type method: str
+        :param req: url
+        :type req: str
+        :return: requests response
+        :rtype: requests.Response
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(self.headers, **kwargs.pop('headers', {}))
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                with self.in_flight:
+                    resp = self.session.request(method, req, headers=headers, auth=self.auth,
+                                                proxies=self.proxies, verify=self.verify, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff(attempt)
+                logging.debug("request(): {} {} failed ({}), retry in {:.1f}s".format(method, req, e, delay))
+            else:
+                if resp.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return resp
+                delay = self.retry_after(resp)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                if resp.status_code == 429:
+                    # hold every thread, not only this one
+                    self.limiter.pause(delay)
+                logging.debug("request(): {} {} returned {}, retry in {:.1f}s".format(method, req, resp.status_code, delay))
+                resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def backoff(self, attempt):
+
+        """
+        :param attempt: number of attempts already failed
+        :type attempt: int
+        :return: delay before the next attempt, exponential with full jitter
+        :rtype: float
+        """
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+
+    def retry_after(self, resp):
+
+        """
+        :param resp: requests response
+        :type resp: requests.Response
+        :return: delay requested by the `Retry-After` header, in seconds
+        :rtype: float
+        """
+
+        value = resp.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0), self.backoff_max)
+
+    def connection_stats(self):
+
+        """
+        Count requests sent and connections opened by the pooled session
+        :return: number of requests, new connections and reused connections
+        :rtype: dict
+        """
+
+        requests_sent = 0
+        connections = 0
+        managers = [self.adapter.poolmanager] + list(self.adapter.proxy_manager.values())
+        for manager in managers:
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    requests_sent += pool.num_requests
+                    connections += pool.num_connections
+        return {'requests': requests_sent,
+                'connections': connections,
+                'reused': max(requests_sent - connections, 0)}
+
+    def close(self):
+
+        """
+        Close the pooled connections, unless they belong to `pool`, and the
+        response cache
+        """
+
+        # Session.close() closes its adapters
+        if self.pool is None:
+            self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def conditions(self, req):
+
+        """
+        :param req: url
+        :type req: str
+        :return: headers of a conditional request if `req` is cached
+        :rtype: dict
+        """
+
+        if self.cache is None:
+            return {}
+        return self.cache.conditions(req)
+
+    def revalidate(self, req, status_code, headers, content):
+
+        """
+        Handle the response of a conditional request
+        :param req: url
+        :type req: str
+        :type status_code: int
+        :param headers: response headers
+        :type headers: dict
+        :param content: response body
+        :type content: bytes
+        :return: response, with `not_modified` set if the cached body is used
+        :rtype: dict
+        """
+
+        if self.cache is not None:
+            content = self.cache.revalidate(req, status_code, headers, content)
+        if status_code in [200, 304]:
+            response = self.response("success", json.loads(content.decode('utf-8')))
+        else:
+            response = self.response("failure", json.loads(content.decode('utf-8')))
+        response['not_modified'] = status_code == 304
+        return response
 
     def response(self, status, content):
         
@@ -54,15 +354,10 @@ class DigitalShadowsApi():
         
         """
         req = self.url + '/api/incidents/{}'.format(id)
-        headers = self.headers
         try:
-            resp = requests.get(req, headers=headers, auth=self.auth,
-                                    proxies=self.proxies, verify=self.verify)
-            if resp.status_code == 200:
-                return self.response("success", resp.json())
-            else:
-                return self.response("failure", resp.json())
-        except requests.exceptions.RequestException as e:
+            resp = self.request('GET', req, headers=self.conditions(req))
+            return self.revalidate(req, resp.status_code, resp.headers, resp.content)
+        except (requests.exceptions.RequestException, ValueError) as e:
             sys.exit("Error: {}".format(e))
 
     def get_intel_incident(self, id, fulltext='true'):
@@ -77,108 +372,96 @@ class DigitalShadowsApi():
         """
 
         req = self.url + '/api/intel-incidents/{}?fulltext='.format(id) + fulltext
-        headers = self.headers
         try:
-            resp = requests.get(req, headers=headers, auth=self.auth,
-                                    proxies=self.proxies, verify=self.verify)
-            if resp.status_code == 200:
-                return self.response("success", resp.json())
-            else:
-                return self.response("failure", resp.json())
-        except requests.exceptions.RequestException as e:
+            resp = self.request('GET', req, headers=self.conditions(req))
+            return self.revalidate(req, resp.status_code, resp.headers, resp.content)
+        except (requests.exceptions.RequestException, ValueError) as e:
             sys.exit("Error: {}".format(e))
 
 
-    def find_incidents(self, since, property='published', direction='ASCENDING'):
+    def paginate(self, find, *args, **kwargs):
+
+        """
+        Walk all the pages of a DigitalShadows search until `total` is reached
+        :param find: paginated method of this class, like find_incidents
+        :type find: function
+        :param size: page size, `page_size` from config by default
+        :type size: int
+        :return: one response per page, stops after the first failure
+        :rtype: generator
+        """
+
+        size = kwargs.pop('size', None) or self.page_size
+        offset = 0
+        while True:
+            response = find(*args, offset=offset, size=size, **kwargs)
+            yield response
+            if response.get('status') != "success":
+                return
+            data = response.get('data')
+            if isinstance(data, ContentStream):
+                data.consume()
+                count = data.count
+            else:
+                count = len(data.get('content', []))
+            offset += count
+            # a page shorter than `size` is not the last one while `total` is not
+            # reached: the server may cap the page size
+            if count == 0 or offset >= data.get('total', 0):
+                return
+
+    def find_incidents(self, since, property='published', direction='ASCENDING', offset=0, size=50, stream=False):
         
         """
         Fetch DigitalShadows `published` (default property param) incidents since last `since` minutes
         :type since: int
         :type property: str
         :type direction: str
+        :param offset: pagination offset
+        :type offset: int
+        :param size: pagination size
+        :type size: int
+        :param stream: decode `content` while it is downloaded, see ContentStream
+        :type stream: bool
         :rtype: request.post
         """
 
         req = self.url + '/api/incidents/find'
-        headers = self.headers
-        payload = json.dumps({
-          "filter": {
-            "severities": [],
-            "tags": [],
-            "tagOperator": "AND",
-            "dateRange": since,
-            "dateRangeField": property,
-            "types": [],
-            "withFeedback": True,
-            "withoutFeedback": True,
-            "alerted": False,
-            "withTakedown": True,
-            "withoutTakedown": True,
-            "withContentRemoved": True,
-            "withoutContentRemoved": True,
-            "statuses": [
-              "UNREAD",
-              "READ"
-            ],
-            "repostedCredentials": []
-          },
-          "sort": {
-            "property": "date",
-            "direction": direction
-          },
-          "pagination": {
-            "size": 50,
-            "offset": 0
-          },
-          "subscribed": True
-        })
+        payload = json.dumps(incidents_query(since, property, direction, offset, size))
         try:
-            resp =  requests.post(req, headers=headers, auth=self.auth, proxies=self.proxies, data=payload, verify=self.verify)
-            if resp.status_code == 200:
+            resp = self.request('POST', req, data=payload, stream=stream)
+            if resp.status_code == 200 and stream:
+                return self.response("success", ContentStream(resp))
+            elif resp.status_code == 200:
                 return self.response("success", resp.json())
             else:
                 return self.response("failure", resp.json())
         except requests.exceptions.RequestException as e:
             sys.exit("Error: {}".format(e))
 
-    def find_intel_incidents(self, since, property='verified', direction='ASCENDING'):
+    def find_intel_incidents(self, since, property='verified', direction='ASCENDING', offset=0, size=50, stream=False):
         
         """
         Fetch DigitalShadows `published` (default property param) intel-incidents since last `since` minutes
         :type since: int
         :type property: str
         :type direction: str
+        :param offset: pagination offset
+        :type offset: int
+        :param size: pagination size
+        :type size: int
+        :param stream: decode `content` while it is downloaded, see ContentStream
+        :type stream: bool
         :rtype: requests response
         """
         
         req = self.url + '/api/intel-incidents/find'
-        headers = self.headers
-
-        payload = json.dumps({
-              "filter": {
-                "severities": [],
-                "tags": [],
-                "tagOperator": "AND",
-                "dateRange": since,
-                "dateRangeField": "published",
-                "types": [],
-                "withFeedback": True,
-                "withoutFeedback": True
-              },
-              "sort": {
-                "property": property,
-                "direction": direction
-              },
-              "pagination": {
-                "size": 50,
-                "offset": 0
-              }
-            })
-
-
+        payload = json.dumps(intel_incidents_query(since, property, direction, offset, size))
         try:
-            resp = requests.post(req, headers=headers, auth=self.auth, proxies=self.proxies, data=payload, verify=self.verify)
-            if resp.status_code == 200:
+            resp = self.request('POST', req, data=payload, stream=stream)
+            if resp.status_code == 200 and stream:
+                return self.response("success", ContentStream(resp))
+            elif resp.status_code == 200:
                 return self.response("success", resp.json())
             else:
                 return self.response("failure", resp.json())
@@ -195,17 +478,9 @@ class DigitalShadowsApi():
         """
         
         req = "{}/api/intel-incidents/{}/iocs".format(self.url, id)
-        headers = self.headers
-        payload = json.dumps({
-            "filter": {},
-            "sort": {
-                "property": "value",
-                "direction": "ASCENDING"
-            }
-        })
+        payload = json.dumps(iocs_query())
         try:
-            return requests.post(req, headers=headers, auth=self.auth, proxies=self.proxies,
-                                     data=payload, verify=self.verify)
+            return self.request('POST', req, data=payload)
         except requests.exceptions.RequestException as e:
                 sys.exit("Error: {}".format(e))
 
@@ -219,10 +494,8 @@ class DigitalShadowsApi():
         """
 
         req = "{}/api/external/downloads/{}".format(self.url, id)
-        headers = self.headers
         try:
-            return requests.get(req, headers=headers, auth=self.auth, proxies=self.proxies,
-                                 verify=self.verify)
+            return self.request('GET', req)
         except requests.exceptions.RequestException as e:
                 sys.exit("Error: {}".format(e))
 
@@ -235,14 +508,60 @@ class DigitalShadowsApi():
         """
 
         req = "{}/api/thumbnails/{}".format(self.url, id)
-        headers = self.headers
         try:
-            return requests.get(req, headers=headers, auth=self.auth, proxies=self.proxies,
-                                 verify=self.verify)
+            return self.request('GET', req)
         except requests.exceptions.RequestException as e:
                 sys.exit("Error: {}".format(e))
 
 
+    def save(self, req, path):
+
+        """
+        Stream a file from DigitalShadows to disk, chunk by chunk
+        :param req: url
+        :type req: str
+        :param path: destination file
+        :type path: str
+        :return: content type, None if the file could not be downloaded
+        :rtype: str
+        """
+
+        try:
+            with self.request('GET', req, stream=True) as resp:
+                if resp.status_code != 200:
+                    logging.debug("save(): {} returned {}".format(req, resp.status_code))
+                    return None
+                with open(path, 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                return resp.headers.get('Content-Type', 'application/octet-stream')
+        except requests.exceptions.RequestException as e:
+            sys.exit("Error: {}".format(e))
+
+    def save_screenshot(self, id, path):
+
+        """
+        Download the screenshot of an incident or intel-incident to `path`
+        :type id: int
+        :type path: str
+        :return: content type, None on failure
+        :rtype: str
+        """
+
+        return self.save("{}/api/external/downloads/{}".format(self.url, id), path)
+
+    def save_thumbnail(self, id, path):
+
+        """
+        Download the thumbnail of an incident or intel-incident to `path`
+        :type id: int
+        :type path: str
+        :return: content type, None on failure
+        :rtype: str
+        """
+
+        return self.save("{}/api/thumbnails/{}".format(self.url, id), path)
+
     def get_databreach(self, id):
         """
         fetch data leakage information
@@ -251,41 +570,28 @@ class DigitalShadowsApi():
         :return: requests response
         """
         req = "{}/api/data-breach/{}".format(self.url, id)
-        headers = self.headers
         try:
-            return requests.get(req, headers=headers, auth=self.auth, proxies=self.proxies,
-                                verify=self.verify)
+            return self.request('GET', req)
         except requests.exceptions.RequestException as e:
             sys.exit("Error: {}".format(e))
 
-    def get_databreach_records(self, id):
+    def get_databreach_records(self, id, offset=0, size=1000, stream=False):
         """
         fetch data leakage information
         :param self:
         :param id: int
+        :param offset: pagination offset
+        :param size: pagination size
+        :param stream: decode `content` while it is downloaded, see ContentStream
         :return: requests response
         """
-        payload = json.dumps({
-          "filter": {
-            "published": "ALL",
-            "domainNames": [],
-            "reviewStatuses": []
-          },
-          "sort": {
-            "property": "username",
-            "direction": "ASCENDING"
-          },
-          "pagination": {
-            "size": 1000,
-            "offset": 0
-          }
-        })
+        payload = json.dumps(databreach_records_query(offset, size))
         req = "{}/api/data-breach/{}/records".format(self.url, id)
-        headers = self.headers
         try:
-            resp = requests.post(req, headers=headers, auth=self.auth, proxies=self.proxies,
-                                data=payload, verify=self.verify)
-            if resp.status_code == 200:
+            resp = self.request('POST', req, data=payload, stream=stream)
+            if resp.status_code == 200 and stream:
+                return self.response("success", ContentStream(resp))
+            elif resp.status_code == 200:
                 return self.response("success", resp.json())
             else:
                 return self.response("failure", resp.json())
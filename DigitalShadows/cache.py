@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import sqlite3
+import threading
+import time
+import logging
+
+class ResponseCache():
+
+    def __init__(self, path, retention=30):
+
+        """
+        Responses of DigitalShadows keyed by URL, with their ETag and
+        Last-Modified headers, to send conditional requests
+        :param path: sqlite database file
+        :type path: str
+        :param retention: number of days an entry is kept
+        :type retention: int
+        """
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                            "url TEXT PRIMARY KEY, "
+                            "etag TEXT, "
+                            "last_modified TEXT, "
+                            "body BLOB NOT NULL, "
+                            "stored REAL NOT NULL)")
+        self.evict(retention)
+
+    def evict(self, retention):
+
+        """
+        Remove responses stored more than `retention` days ago
+        :type retention: int
+        """
+
+        with self.lock, self.db:
+            deleted = self.db.execute("DELETE FROM responses WHERE stored < ?",
+                                      (time.time() - retention * 86400,)).rowcount
+        logging.debug("ResponseCache.evict(): {} responses older than {} days removed".format(deleted, retention))
+
+    def conditions(self, url):
+
+        """
+        :type url: str
+        :return: headers of a conditional request, empty if `url` is not cached
+        :rtype: dict
+        """
+
+        with self.lock:
+            row = self.db.execute("SELECT etag, last_modified FROM responses WHERE url = ?", (url,)).fetchone()
+        headers = {}
+        if row is not None and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row is not None and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def revalidate(self, url, status_code, headers, body):
+
+        """
+        Store a response which has validators, or restore the cached one
+        :type url: str
+        :type status_code: int
+        :param headers: response headers
+        :type headers: dict
+        :param body: response body
+        :type body: bytes
+        :return: body, the cached one on 304 Not Modified
+        :rtype: bytes
+        """
+
+        if status_code == 304:
+            with self.lock, self.db:
+                row = self.db.execute("SELECT body FROM responses WHERE url = ?", (url,)).fetchone()
+                self.db.execute("UPDATE responses SET stored = ? WHERE url = ?", (time.time(), url))
+                self.hits += 1
+            return row[0] if row is not None else body
+
+        with self.lock:
+            self.misses += 1
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if status_code == 200 and (etag or last_modified):
+            with self.lock, self.db:
+                self.db.execute("INSERT OR REPLACE INTO responses (url, etag, last_modified, body, stored) "
+                                "VALUES (?, ?, ?, ?, ?)", (url, etag, last_modified, body, time.time()))
+        return body
+
+    def stats(self):
+
+        """
+        :return: responses not modified and downloaded
+        :rtype: dict
+        """
+
+        with self.lock:
+            return {'not_modified': self.hits, 'downloaded': self.misses}
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import threading
+import time
+
+class TokenBucket():
+
+    def __init__(self, rate, burst=1):
+
+        """
+        Token bucket shared by all the threads sending requests
+        :param rate: number of requests per second, 0 for no limit
+        :type rate: float
+        :param burst: number of requests which can be sent at once
+        :type burst: int
+        """
+
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+
+        """
+        Take a token if one is available
+        :return: 0 if a request can be sent, otherwise the delay to wait before trying again
+        :rtype: float
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            if self.paused_until > now:
+                return self.paused_until - now
+            if not self.rate:
+                return 0
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+
+        """
+        Wait until a request can be sent
+        """
+
+        delay = self.reserve()
+        while delay:
+            time.sleep(delay)
+            delay = self.reserve()
+
+    def pause(self, delay):
+
+        """
+        Hold every request for `delay` seconds, i.e. when the API asks to slow down
+        :type delay: float
+        """
+
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+import sys
+import logging
+
+from urllib3.exceptions import HTTPError
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+SCALARS = ['null', 'boolean', 'integer', 'double', 'number', 'string']
+
+class ContentStream(dict):
+
+    def __init__(self, resp):
+
+        """
+        Body of a paginated DigitalShadows response decoded while it is read
+        from the socket. `content` is an iterator yielding one item at a time,
+        the other top-level fields (i.e. `total`) are set as they are parsed,
+        so they may only be known once `content` has been consumed.
+        Requires ijson.
+        :param resp: response sent with stream=True
+        :type resp: requests.Response
+        """
+
+        super().__init__()
+        self.resp = resp
+        self.count = 0
+        self['content'] = self.decode()
+
+    def decode(self):
+        builder = None
+        self.resp.raw.decode_content = True
+        try:
+            for prefix, event, value in ijson.parse(self.resp.raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == 'content.item' and event in ['end_map', 'end_array']:
+                        self.count += 1
+                        yield builder.value
+                        builder = None
+                elif prefix == 'content.item':
+                    if event in ['start_map', 'start_array']:
+                        builder = ijson.ObjectBuilder()
+                        builder.event(event, value)
+                    else:
+                        self.count += 1
+                        yield value
+                elif prefix and '.' not in prefix and event in SCALARS:
+                    self[prefix] = value
+            self.resp.raw.release_conn()
+        except (ijson.JSONError, HTTPError, OSError) as e:
+            logging.debug("ContentStream.decode(): {} decoding failed: {}".format(self.resp.url, e))
+            sys.exit("Error: {}".format(e))
+        finally:
+            # the connection can't be reused if the body was not read to the end
+            self.resp.close()
+
+    def consume(self):
+
+        """
+        Read the rest of the body, i.e. to get `total`
+        """
+
+        for _ in self['content']:
+            pass
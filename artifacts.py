@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import logging
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class ArtifactStore():
+
+    def __init__(self, directory=None, max_bytes=0):
+
+        """
+        Files attached to alerts (databreach records, images), written in one
+        folder per alert so that alerts can be built concurrently, and
+        removed once the alert has been built or uploaded
+        :param directory: parent folder, the system temp folder by default
+        :type directory: str
+        :param max_bytes: max size of all the files held at once, 0 for no limit
+        :type max_bytes: int
+        """
+
+        self.directory = directory or None
+        self.max_bytes = max_bytes
+        self.root = None
+        self.used = 0
+        self.peak = 0
+        self.refused = 0
+        self.lock = threading.Lock()
+
+    def folder(self):
+
+        """
+        :return: new folder for the files of an alert
+        :rtype: ArtifactFolder
+        """
+
+        return ArtifactFolder(self)
+
+    def mkdtemp(self):
+        with self.lock:
+            if self.root is None:
+                self.root = tempfile.mkdtemp(prefix='ds2th-', dir=self.directory)
+            root = self.root
+        return tempfile.mkdtemp(prefix='alert-', dir=root)
+
+    def reserve(self, size):
+
+        """
+        :param size: number of bytes about to be written
+        :type size: int
+        :return: False if they don't fit in `max_bytes`
+        :rtype: bool
+        """
+
+        with self.lock:
+            if self.max_bytes and self.used + size > self.max_bytes:
+                return False
+            self.used += size
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def free(self, size):
+        with self.lock:
+            self.used -= size
+
+    def refuse(self):
+
+        """
+        Count a file which was truncated or dropped because of the quota
+        """
+
+        with self.lock:
+            self.refused += 1
+
+    def stats(self):
+
+        """
+        :return: bytes held, highest bytes held and files refused by the quota
+        :rtype: dict
+        """
+
+        with self.lock:
+            return {'bytes': self.used, 'peak': self.peak, 'refused': self.refused}
+
+    def close(self):
+
+        """
+        Remove the folders still there, i.e. after an error
+        """
+
+        with self.lock:
+            root, self.root = self.root, None
+        if root is not None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+class ArtifactFolder():
+
+    def __init__(self, store):
+
+        """
+        Folder of the files of one alert, see ArtifactStore.folder(). It is
+        only created on disk when the alert has files.
+        :type store: ArtifactStore
+        """
+
+        self.store = store
+        self.directory = None
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def path(self, name):
+        with self.lock:
+            if self.directory is None:
+                self.directory = self.store.mkdtemp()
+            directory = self.directory
+        return os.path.join(directory, name)
+
+    def open(self, name):
+
+        """
+        :param name: file name
+        :type name: str
+        :return: text file counted in the quota, write() raises QuotaExceeded
+        :rtype: ArtifactFile
+        """
+
+        return ArtifactFile(self, self.path(name))
+
+    def reserve(self, size):
+        if not self.store.reserve(size):
+            return False
+        with self.lock:
+            self.size += size
+        return True
+
+    def free(self, size):
+        self.store.free(size)
+        with self.lock:
+            self.size -= size
+
+    def add(self, path):
+
+        """
+        Count a file written in the folder by someone else, i.e. a download
+        :param path: file in the folder
+        :type path: str
+        :return: False if the file did not fit in the quota and was removed
+        :rtype: bool
+        """
+
+        size = os.path.getsize(path)
+        if self.reserve(size):
+            return True
+        self.store.refuse()
+        logging.debug("ArtifactFolder.add(): {} removed, {} bytes exceed the quota".format(os.path.basename(path), size))
+        os.remove(path)
+        return False
+
+    def release(self):
+
+        """
+        Remove the folder and its files
+        """
+
+        with self.lock:
+            directory, self.directory = self.directory, None
+            size, self.size = self.size, 0
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+        self.store.free(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ArtifactFile():
+
+    # bytes reserved at once, to keep the quota lock out of the write loop
+    CHUNK = 1024 * 1024
+
+    def __init__(self, folder, path):
+
+        """
+        Text file of an ArtifactFolder. Sizes are counted in characters.
+        :type folder: ArtifactFolder
+        :type path: str
+        """
+
+        self.folder = folder
+        self.name = path
+        self.file = open(path, 'w')
+        self.written = 0
+        self.reserved = 0
+
+    def write(self, s):
+        written = self.written + len(s)
+        if written > self.reserved:
+            needed = written - self.reserved
+            if self.folder.reserve(max(self.CHUNK, needed)):
+                self.reserved += max(self.CHUNK, needed)
+            elif needed < self.CHUNK and self.folder.reserve(needed):
+                self.reserved += needed
+            else:
+                self.folder.store.refuse()
+                raise QuotaExceeded("{}: artifact quota of {} bytes reached".format(self.name, self.folder.store.max_bytes))
+        self.file.write(s)
+        self.written = written
+
+    def close(self):
+        self.file.close()
+        # give back what was reserved but not written
+        self.folder.free(self.reserved - self.written)
+        self.reserved = self.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-ins for the DigitalShadows endpoints used by DigitalShadows/api.py
+and for the alert endpoints of TheHive, serving synthetic data, to run
+ds2th.py without a DigitalShadows tenant or a TheHive instance. See
+benchmarks/feeder.py.
+"""
+
+import re
+import json
+import time
+import zlib
+import struct
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+INCIDENT_IDS = 1
+INTEL_INCIDENT_IDS = 1000001
+
+IOC_TYPES = ['IP', 'HOST', 'URL', 'SHA256', 'SHA1', 'MD5', 'FILENAME', 'EMAIL', 'CVE']
+
+# payload shapes, see Scenario
+SHAPES = {
+    'mixed': {},
+    'breaches': {'breach_ratio': 1.0, 'records': 20000},
+    'thumbnails': {'thumbnail_bytes': 2 * 1024 * 1024},
+    'iocs': {'iocs': 5000},
+}
+
+
+class Scenario():
+
+    def __init__(self, incidents=200, intel_incidents=50, latency=0.02, thehive_latency=0.02,
+                 max_page_size=50, breach_ratio=0.25, records=1000, thumbnail_bytes=20 * 1024,
+                 iocs=50, text_bytes=2000):
+
+        """
+        What the fake servers serve
+        :param incidents: number of incidents
+        :param intel_incidents: number of intel-incidents
+        :param latency: seconds before DigitalShadows answers
+        :param thehive_latency: seconds before TheHive answers
+        :param max_page_size: page size of searches, whatever is asked
+        :param breach_ratio: share of incidents which are databreaches
+        :param records: records per databreach
+        :param thumbnail_bytes: size of thumbnails and screenshots
+        :param iocs: IOCs per intel-incident
+        :param text_bytes: size of summaries and descriptions
+        """
+
+        self.incidents = incidents
+        self.intel_incidents = intel_incidents
+        self.latency = latency
+        self.thehive_latency = thehive_latency
+        self.max_page_size = max_page_size
+        self.breach_ratio = breach_ratio
+        self.records = records
+        self.thumbnail_bytes = thumbnail_bytes
+        self.iocs = iocs
+        self.text_bytes = text_bytes
+        self.image = png(thumbnail_bytes)
+
+    @classmethod
+    def shape(cls, name, **kwargs):
+        return cls(**dict(SHAPES[name], **kwargs))
+
+    def incident_ids(self):
+        return list(range(INCIDENT_IDS, INCIDENT_IDS + self.incidents))
+
+    def intel_incident_ids(self):
+        return list(range(INTEL_INCIDENT_IDS, INTEL_INCIDENT_IDS + self.intel_incidents))
+
+
+def png(size):
+
+    """
+    :param size: approximate number of bytes
+    :type size: int
+    :return: grey noise PNG image, stored without compression
+    :rtype: bytes
+    """
+
+    width = max(int((size / 3) ** 0.5), 1)
+    rng = random.Random(size)
+    rows = b"".join(b"\x00" + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(width))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, width, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(rows, 0)) +
+            chunk(b"IEND", b""))
+
+def text(size, seed):
+    return ("Lorem ipsum dolor sit amet #{}, consectetur adipiscing elit. ".format(seed) * (size // 60 + 1))[:size]
+
+def incident(scenario, id):
+
+    """
+    :return: synthetic DS incident, a databreach for `breach_ratio` of them
+    :rtype: dict
+    """
+
+    published = "2020-01-01T00:{:02d}:{:02d}Z".format(id // 60 % 60, id % 60)
+    entity = {'source': 'paste', 'domain': 'example.com', 'sourceDate': published, 'type': 'PASTE',
+              'summaryText': text(scenario.text_bytes // 4, id),
+              'screenshotThumbnailId': "th{}".format(id), 'screenshotId': "sc{}".format(id)}
+    if int(id * scenario.breach_ratio) != int((id - 1) * scenario.breach_ratio):
+        entity['dataBreach'] = {'id': id, 'title': "breach {}".format(id), 'domainName': 'example.com'}
+    return {'id': id, 'scope': 'ORGANIZATION', 'type': 'DATA_LEAKAGE', 'severity': 'HIGH',
+            'title': "Incident {}".format(id), 'occurred': published, 'verified': published,
+            'modified': published, 'published': published,
+            'summary': text(scenario.text_bytes, id), 'description': text(scenario.text_bytes, id),
+            'impactDescription': text(scenario.text_bytes // 4, id), 'mitigation': text(scenario.text_bytes // 4, id),
+            'tags': [{'type': 'x', 'name': 'leak'}, {'type': 'y', 'name': 'credentials'}],
+            'entitySummary': entity}
+
+def intel_incident(scenario, id):
+    published = "2020-01-01T00:{:02d}:{:02d}Z".format(id // 60 % 60, id % 60)
+    return {'id': id, 'scope': 'GLOBAL', 'type': 'CYBER_THREAT', 'severity': 'MEDIUM',
+            'title': "Intel incident {}".format(id), 'occurred': published, 'verified': published,
+            'modified': published, 'published': published,
+            'summary': text(scenario.text_bytes, id), 'description': text(scenario.text_bytes, id),
+            'tags': [{'type': 'actor', 'name': 'apt'}],
+            'entitySummary': {'source': 'blog', 'summaryText': text(scenario.text_bytes // 4, id),
+                              'screenshotThumbnailId': "th{}".format(id)}}
+
+def iocs(scenario, id):
+    return [{'type': IOC_TYPES[k % len(IOC_TYPES)], 'value': "ioc-{}-{}".format(id, k), 'source': "source{}".format(k % 4)}
+            for k in range(scenario.iocs)]
+
+def records(scenario, id, offset, size):
+    return [{'id': k, 'username': "user{}@example.com".format(k) if k % 3 else "user{}".format(k),
+             'password': "secret{}".format(k), 'published': '2020-01-01T00:00:00Z',
+             'priorRowTextBreachCount': k % 5, 'priorUsernameBreachCount': k % 7}
+            for k in range(offset, min(offset + size, scenario.records))]
+
+def page(body, limit):
+
+    """
+    :return: offset and size of the page asked in a search, at most `limit`
+    :rtype: tuple
+    """
+
+    pagination = body.get('pagination') or {}
+    return pagination.get('offset', 0), min(pagination.get('size', limit), limit)
+
+
+class FakeServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, handler, scenario):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.scenario = scenario
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.alerts = 0
+        self.artifacts = 0
+        self.alert_bytes = 0
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_port)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'alerts': self.alerts, 'artifacts': self.artifacts,
+                    'alert_bytes': self.alert_bytes}
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately: without TCP_NODELAY, Nagle and
+    # the client's delayed ACK hold the body back ~40 ms on keep-alive
+    disable_nagle_algorithm = True
+    latency = 'latency'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        time.sleep(getattr(self.server.scenario, self.latency))
+        with self.server.lock:
+            self.server.requests += 1
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+
+class DigitalShadowsHandler(Handler):
+
+    def do_GET(self):
+        scenario = self.server.scenario
+        path = urlsplit(self.path).path
+        if path.startswith('/api/thumbnails/') or path.startswith('/api/external/downloads/'):
+            return self.send(200, scenario.image, 'image/png')
+        m = re.match(r'^/api/(incidents|intel-incidents)/(\d+)$', path)
+        if m:
+            id = int(m.group(2))
+            if m.group(1) == 'incidents' and id in range(INCIDENT_IDS, INCIDENT_IDS + scenario.incidents):
+                return self.send(200, incident(scenario, id))
+            if m.group(1) == 'intel-incidents' and id in range(INTEL_INCIDENT_IDS, INTEL_INCIDENT_IDS + scenario.intel_incidents):
+                return self.send(200, intel_incident(scenario, id))
+        m = re.match(r'^/api/data-breach/(\d+)$', path)
+        if m:
+            return self.send(200, {'id': int(m.group(1)), 'title': "breach {}".format(m.group(1))})
+        self.send(404, {'message': "{} not found".format(path)})
+
+    def do_POST(self):
+        scenario = self.server.scenario
+        path = urlsplit(self.path).path
+        body = json.loads(self.body() or b'{}')
+        if path in ['/api/incidents/find', '/api/intel-incidents/find']:
+            if path == '/api/incidents/find':
+                ids, build = scenario.incident_ids(), incident
+            else:
+                ids, build = scenario.intel_incident_ids(), intel_incident
+            offset, size = page(body, scenario.max_page_size)
+            return self.send(200, {'total': len(ids), 'content': [build(scenario, id) for id in ids[offset:offset + size]]})
+        m = re.match(r'^/api/intel-incidents/(\d+)/iocs$', path)
+        if m:
+            content = iocs(scenario, int(m.group(1)))
+            return self.send(200, {'total': len(content), 'content': content})
+        m = re.match(r'^/api/data-breach/(\d+)/records$', path)
+        if m:
+            offset, size = page(body, scenario.records)
+            return self.send(200, {'total': scenario.records,
+                                   'content': records(scenario, int(m.group(1)), offset, size)})
+        self.send(404, {'message': "{} not found".format(path)})
+
+
+class TheHiveHandler(Handler):
+
+    latency = 'thehive_latency'
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self.body()
+        if path == '/api/alert':
+            with self.server.lock:
+                self.server.alerts += 1
+                self.server.alert_bytes += len(body)
+                id = self.server.alerts
+            return self.send(201, {'id': "alert{}".format(id), 'sourceRef': json.loads(body).get('sourceRef')})
+        if re.match(r'^/api/alert/[^/]+/artifact$', path):
+            with self.server.lock:
+                self.server.artifacts += 1
+            return self.send(201, [{'id': "artifact"}])
+        self.send(404, {'type': 'NotFound', 'message': "{} not found".format(path)})
+
+
+def start(scenario):
+
+    """
+    :type scenario: Scenario
+    :return: DigitalShadows and TheHive stand-ins, serving
+    :rtype: tuple
+    """
+
+    return FakeServer(DigitalShadowsHandler, scenario).start(), FakeServer(TheHiveHandler, scenario).start()
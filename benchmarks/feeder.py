@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmark of ds2th.py against the local DigitalShadows and TheHive
+stand-ins of benchmarks/fakes.py: runs `find` and `inc` in a child process
+each and reports incidents/sec, p50/p99 latency of each stage and peak RSS.
+The configuration is config/config.py.template with the fake servers, no
+forwarded index, checkpoint or response cache, and the --set overrides.
+
+    python3 benchmarks/feeder.py [--shape SHAPE] [-n INCIDENTS] [-N INTEL]
+                                 [--latency MS] [--thehive-latency MS]
+                                 [--page-size N] [-a] [--set KEY=VALUE ...]
+"""
+
+import os
+import sys
+import ast
+import json
+import time
+import math
+import types
+import runpy
+import argparse
+import tempfile
+import functools
+import inspect
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from fakes import Scenario, SHAPES, start
+
+# stage -> methods of DigitalShadowsApi and AsyncDigitalShadowsApi
+API_STAGES = {
+    'ds.find': ['find_incidents', 'find_intel_incidents'],
+    'ds.get': ['get_incident', 'get_intel_incident'],
+    'ds.thumbnail': ['get_thumbnail'],
+    'ds.images': ['save_screenshot', 'save_thumbnail'],
+    'ds.iocs': ['get_intel_incident_iocs'],
+    'ds.records': ['get_databreach_records'],
+}
+
+# stage -> functions of ds2th
+FEEDER_STAGES = {
+    'enrich': ['enrich_incident', 'async_enrich_incident'],
+    'build_alert': ['build_alert'],
+    'thehive.create': ['submit_alert'],
+}
+
+COMMANDS = ['find', 'inc']
+
+
+def timed(func, durations):
+
+    """
+    :return: `func`, appending the duration of each call to `durations`
+    :rtype: function
+    """
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start)
+    return wrapper
+
+def instrument(ds2th, asynchronous):
+
+    """
+    Time the stages of ds2th
+    :return: durations of each stage
+    :rtype: dict
+    """
+
+    from DigitalShadows.api import DigitalShadowsApi
+    stages = {stage: [] for stage in list(API_STAGES) + list(FEEDER_STAGES)}
+    classes = [DigitalShadowsApi]
+    if asynchronous:
+        from DigitalShadows.aioapi import AsyncDigitalShadowsApi
+        classes.append(AsyncDigitalShadowsApi)
+    for cls in classes:
+        for stage, names in API_STAGES.items():
+            for name in names:
+                if name in vars(cls):
+                    setattr(cls, name, timed(vars(cls)[name], stages[stage]))
+    for stage, names in FEEDER_STAGES.items():
+        for name in names:
+            setattr(ds2th, name, timed(getattr(ds2th, name), stages[stage]))
+    return stages
+
+def peak_rss():
+
+    """
+    :return: peak resident set size of this process, in bytes
+    :rtype: int
+    """
+
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def child(spec):
+
+    """
+    Run ds2th.py as described by `spec` and write the measures to spec['result']
+    """
+
+    template = runpy.run_path(os.path.join(ROOT, 'config', 'config.py.template'))
+    config = types.ModuleType('config')
+    config.DigitalShadows = template['DigitalShadows']
+    config.TheHive = template['TheHive']
+    config.DigitalShadows.update(url=spec['ds_url'], index_file='', checkpoint_file='', response_cache_file='',
+                                 log_file=os.path.join(spec['workdir'], 'ds2th.log'),
+                                 monitoring_file=os.path.join(spec['workdir'], 'ds2th.status'))
+    config.TheHive.update(url=spec['thehive_url'])
+    for key, value in spec['settings']:
+        if key.startswith('TheHive.'):
+            config.TheHive[key[len('TheHive.'):]] = value
+        else:
+            config.DigitalShadows[key] = value
+    sys.modules['config'] = config
+
+    import ds2th
+    stages = instrument(ds2th, '-a' in spec['argv'])
+    sys.argv = ['ds2th.py'] + spec['argv']
+    start = time.perf_counter()
+    ds2th.run()
+    elapsed = time.perf_counter() - start
+    with open(spec['result'], 'w') as f:
+        json.dump({'elapsed': elapsed, 'stages': stages, 'peak_rss': peak_rss()}, f)
+
+def percentile(durations, p):
+    if not durations:
+        return 0
+    durations = sorted(durations)
+    return durations[max(int(math.ceil(p * len(durations))) - 1, 0)]
+
+def run_command(command, scenario, ds, thehive, args, workdir):
+
+    """
+    Run a ds2th.py command in a child process against the fake servers
+    :return: measures
+    :rtype: dict
+    """
+
+    argv = ['-a'] if args.asyncio else []
+    if command == 'find':
+        argv += ['find', '-l', '60']
+    else:
+        paths = []
+        for name, ids in [('incidents', scenario.incident_ids()), ('intel-incidents', scenario.intel_incident_ids())]:
+            path = os.path.join(workdir, "{}.txt".format(name))
+            with open(path, 'w') as f:
+                f.write("\n".join(str(id) for id in ids))
+            paths += ["--{}-file".format(name), path]
+        argv += ['inc'] + paths
+
+    spec = {'ds_url': ds.url, 'thehive_url': thehive.url, 'settings': args.settings, 'argv': argv,
+            'workdir': workdir, 'result': os.path.join(workdir, "{}.json".format(command))}
+    before_ds, before_thehive = ds.stats(), thehive.stats()
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', json.dumps(spec)],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0 or not os.path.exists(spec['result']):
+        sys.exit("{} failed:\n{}".format(command, proc.stderr))
+    with open(spec['result']) as f:
+        result = json.load(f)
+    after_ds, after_thehive = ds.stats(), thehive.stats()
+    alerts = after_thehive['alerts'] - before_thehive['alerts']
+    result.update(command=command,
+                  alerts=alerts,
+                  rate=alerts / result['elapsed'] if result['elapsed'] else 0,
+                  ds_requests=after_ds['requests'] - before_ds['requests'],
+                  alert_bytes=(after_thehive['alert_bytes'] - before_thehive['alert_bytes']) / alerts if alerts else 0,
+                  stages={stage: {'count': len(d), 'p50': percentile(d, 0.5), 'p99': percentile(d, 0.99)}
+                          for stage, d in result['stages'].items() if d})
+    return result
+
+def setting(value):
+
+    """
+    :param value: KEY=VALUE, a DigitalShadows key or TheHive.KEY, VALUE a Python literal
+    :return: key and value
+    :rtype: tuple
+    """
+
+    key, sep, literal = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError("{}: expected KEY=VALUE".format(value))
+    try:
+        return key, ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        return key, literal
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark ds2th.py against local DigitalShadows and TheHive stand-ins")
+    parser.add_argument("--shape", choices=sorted(SHAPES), default='mixed',
+                        help="payloads: big breaches, large thumbnails or many IOCs (default: mixed)")
+    parser.add_argument("-n", "--incidents", type=int, default=200,
+                        help="number of incidents (default: 200)")
+    parser.add_argument("-N", "--intel-incidents", type=int, default=50,
+                        help="number of intel-incidents (default: 50)")
+    parser.add_argument("--latency", type=float, default=20,
+                        help="DigitalShadows response time in ms (default: 20)")
+    parser.add_argument("--thehive-latency", type=float, default=20,
+                        help="TheHive response time in ms (default: 20)")
+    parser.add_argument("--page-size", type=int, default=50,
+                        help="max page size of DigitalShadows searches (default: 50)")
+    parser.add_argument("--records", type=int,
+                        help="records per databreach")
+    parser.add_argument("--thumbnail-bytes", type=int,
+                        help="size of thumbnails and screenshots")
+    parser.add_argument("--iocs", type=int,
+                        help="IOCs per intel-incident")
+    parser.add_argument("-c", "--commands", nargs='+', choices=COMMANDS, default=COMMANDS,
+                        help="ds2th.py commands to run (default: find inc)")
+    parser.add_argument("-a", "--asyncio", action='store_true', default=False,
+                        help="run ds2th.py with -a")
+    parser.add_argument("-s", "--set", dest='settings', metavar="KEY=VALUE", type=setting, action='append', default=[],
+                        help="override a DigitalShadows setting, or TheHive.KEY, e.g. max_workers=8")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="also write the measures to FILE as JSON")
+    args = parser.parse_args()
+
+    shape = {k: v for k, v in [('records', args.records), ('thumbnail_bytes', args.thumbnail_bytes),
+                                ('iocs', args.iocs)] if v is not None}
+    scenario = Scenario.shape(args.shape, incidents=args.incidents, intel_incidents=args.intel_incidents,
+                              latency=args.latency / 1000, thehive_latency=args.thehive_latency / 1000,
+                              max_page_size=args.page_size, **shape)
+    ds, thehive = start(scenario)
+
+    print("{} shape: {} incidents, {} intel-incidents, {} records/breach, {} bytes/thumbnail, {} IOCs, "
+          "DS {:.0f} ms, TheHive {:.0f} ms{}".format(args.shape, scenario.incidents, scenario.intel_incidents,
+                                                     scenario.records, len(scenario.image), scenario.iocs,
+                                                     args.latency, args.thehive_latency,
+                                                     "".join(", {}={!r}".format(k, v) for k, v in args.settings)))
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ds2th-bench-') as workdir:
+        for command in args.commands:
+            result = run_command(command, scenario, ds, thehive, args, workdir)
+            results.append(result)
+            print("\n{:<8} {:>8} {:>9} {:>12} {:>12} {:>12} {:>10}".format(
+                "run", "alerts", "seconds", "incidents/s", "DS requests", "alert bytes", "peak RSS"))
+            print("{:<8} {:>8} {:>9.2f} {:>12.1f} {:>12} {:>12,.0f} {:>7.1f} MB".format(
+                command, result['alerts'], result['elapsed'], result['rate'], result['ds_requests'],
+                result['alert_bytes'], result['peak_rss'] / 1024 / 1024))
+            print("  {:<16} {:>8} {:>10} {:>10}".format("stage", "count", "p50 ms", "p99 ms"))
+            for stage, measures in result['stages'].items():
+                print("  {:<16} {:>8} {:>10.1f} {:>10.1f}".format(stage, measures['count'],
+                                                                measures['p50'] * 1000, measures['p99'] * 1000))
+    ds.shutdown()
+    thehive.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'shape': args.shape, 'settings': args.settings, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        child(json.loads(sys.argv[2]))
+    else:
+        run()
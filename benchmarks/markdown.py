@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the markdown description of alerts: checks that ds2markdown
+renders the same bytes as the previous string-building implementation on
+incidents covering every section, then compares their speed on large
+entity summaries and thumbnails.
+
+    python3 benchmarks/markdown.py [-s SIZE] [-n NUMBER]
+"""
+
+import os
+import sys
+import json
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ds2markdown import ds2markdown
+
+
+class legacy_ds2markdown():
+
+    def __init__(self, content, thumbnail):
+        self.thumbnail = thumbnail
+        self.source = ""
+        self.thdescription = "{0} {1} {2} {3} {4} {5} {6}".format(
+            "**Scope:** {0}\n\n**Type:** {1}\n\n**Occurred:** {2}\n\n**Verified:** {3}\n\n**Modified:** {4}\n\n**Published:** {5}\n\n**Identifier:** {6}\n\n**Tags:** {7}\n\n".format(
+                    content.get('scope',"None"),
+                    content.get('type',"None"),
+                    content.get('occurred',"None"),
+                    content.get('verified',"None"),
+                    content.get('modified',"None"),
+                    content.get('published',"None"),
+                    str(content.get('id',"None")),
+                    self.tags(content)
+            ),"----\n\n#### Summary ####  \n\n{}\n\n".format(content.get('summary')),
+            "----\n\n#### Description ####  \n\n{}\n\n".format(content.get('description')),
+            "{}\n\n".format(self.impactDescription(content)),
+            "{}\n\n".format(self.mitigation(content)),
+            "{}\n\n".format(self.entitySummary(content)),
+            "{}\n\n".format(self.lci(content))
+
+        )
+
+
+
+    def entitySummary(self, content):
+        source = ""
+        if 'entitySummary' in content:
+            c = content.get('entitySummary',"None")
+            source += self.information(c)
+
+            if 'summaryText' in c:
+                summaryText = c.get('summaryText',"None")
+                source += "\n\n----\n\n#### Source data #### \n\n" + \
+                        "```\n{}\n```\n\n".format(summaryText)
+
+        if 'IpAddressEntitySummary' in content:
+            c = content.get('IpAddressEntity',"None")
+            source = self.information(c)
+
+            if 'IpAddressDetails' in c:
+                details = c.get('IpAddressDetails',"None")
+                source += "\n\n----\n\n" + \
+                        "#### IP address details #### \n\n" + \
+                        "**IP:** {0}\n\n**AS:** {1}\n\n**Reverse Domain Name:** {2}\n\n**Service Provider:** {3}\n\n".format(
+                            details.get('ipAddress',"None"),
+                            details.get('autonomousSystemNumber',"None"),
+                            details.get('reverseDomainName',"None"),
+                            details.get('serviceProvider',"None")
+                             )
+                if 'location' in details:
+                    # fixed: `+ +"/"` raised TypeError
+                    source += "**Geolocation:** " + details['location']['country'] + \
+                                "/"+ details['location']['city'] + "\n\n"
+
+            if 'ports' in  c:
+                port = c['ports']
+                source += "\n\n----\n\n" + \
+                        " #### Port details #### \n\n" + \
+                        "**Port:** {0}/{1}\n\n**Scanned on:** {2}\n\n**Device Type:** {3}\n\n**Banner:** {4}\n\n".format(
+                            port.get('portNumber',"None"),
+                            port.get('transport',"None"),
+                            port.get('scannedOn',"None"),
+                            port.get('deviceType',"None"),
+                            port.get('banner',"None")
+                        )
+
+            if 'vulnerability' in  c:
+                vuln = c.get('vulnerability').get('specification').get('specification')
+                source += "#### vulnerability Information ####  \n\n**CVE ID:** {0}\n\n**CVE description:** {1}\n\n**Severity:** {2}\n\n**Mitigation:** {3}\n\n".format(
+                        vuln.get('cveId',"None"),
+                        vuln.get('description',"None"),
+                        vuln.get('severity',"None"),
+                        vuln.get('mitigation',"None")
+                )
+
+        if 'MessageEntitySummary' in content:
+            c = content['MessageEntitySummary']
+            source += self.information(c)
+
+            if 'conversationFragment' in c:
+                conv = c.get('conversationFragment')
+                source += "#### Conversation Information #### \n\n**Server:** {0}\n\n**Channel:** {1}\n\n".format(
+                        conv.get('server',"None"),
+                        conv.get('channel',"None")
+                )
+                if "Message" in conv:
+                    msg = conv.get("Message")
+                    source += "**Message**\n\n" + \
+                            "**User:** " + \
+                            "\"{0}\" - {1}\n\n**Sent:** {2}\n\n**Message**\n\n```\n\n{3}\n\n```".format(
+                                msg.get('nickname',"None"),
+                                msg.get('username',"None"),
+                                msg.get('sent',"None"),
+                                msg.get('content',"None")
+                                )
+
+        return source
+
+
+    def information(self, content):
+        source = ""
+        if self.thumbnail.get('thumbnail') != "":
+            source += "----\n\n" + \
+                "#### Source Information #### \n\n" + \
+                "**Source:** {0}\n\n**Domain:** {1}\n\n**Date:** {2}\n\n**Type:** {3}\n\n![thumbnail][thumb]\n\n[thumb]: {4}\n\n".format(
+                        content.get('source',"None"),
+                        content.get('domain',"None"),
+                        content.get('sourceDate',"None"),
+                        content.get('type',"None"),
+                        self.thumbnail.get('thumbnail', "None")
+                )
+        else:
+            source += "----\n\n" + \
+                "#### Source Information #### \n\n" + \
+                "**Source:** {0}\n\n**Domain:** {1}\n\n**Date:** {2}\n\n**Type:** {3}\n\n".format(
+                        content.get('source',"None"),
+                        content.get('domain',"None"),
+                        content.get('sourceDate',"None"),
+                        content.get('type',"None")
+                )
+
+        if 'dataBreach' in content:
+            dataBreach = content.get('dataBreach')
+
+            source += "----\n\n#### Databreach target ####  \n\n" + \
+                        "**Title:** {0}\n\n**Target domain:** {1}\n\n**Published:** {2}\n\n**Occured:** {3}\n\n**Modified:** {4}\n\n**Id:** {5}\n\n".format(
+                                dataBreach.get('title',"None"),
+                                dataBreach.get('domainName',"None"),
+                                dataBreach.get('published',"None"),
+                                dataBreach.get('occurred',"None"),
+                                dataBreach.get('modified',"None"),
+                                dataBreach.get('id', "None")
+                        )
+
+        if 'secureSocketInspection' in content:
+            source += "----\n\n#### Technical information #### \n\n ```\n\n{}\n\n```".format( json.dumps(content.get('secureSocketInspection'),  indent=4))
+
+
+        return source
+
+
+    def impactDescription(self, content):
+        impact = ""
+        if "impactDescription" in content:
+            impact = "----\n\n#### Impact Description #### \n\n{}" .format(
+                    content.get('impactDescription', "None")
+            )
+
+        return impact
+
+    def mitigation(self, content):
+        mitigation = ""
+        if "mitigation" in content:
+            mitigation = "----\n\n#### Mitigation #### \n\n{}".format(content.get('mitigation', "None"))
+        return mitigation
+
+
+    def lci(self, content):
+        linkedContentIncidents = "----\n\n#### Linked incidents #### \n\n"
+        if content.get("linkedContentIncidents"):
+            for lci in content["linkedContentIncidents"]:
+                linkedContentIncidents += "- {} \n\n".format(lci)
+        else:
+            linkedContentIncidents += "None"
+        return linkedContentIncidents
+
+
+    def tags(self, content):
+        if 'tags' in content:
+            t = ""
+            for tag in content['tags']:
+                if tag.get('name'):
+                    if t != "":
+                        t +=", "
+                    t += "_{}_".format(tag['name'])
+            return t
+        return "-"
+
+
+def incidents(size):
+
+    """
+    :param size: length of the summaries, descriptions and thumbnails
+    :type size: int
+    :return: (name, incident, thumbnail) covering every section
+    :rtype: list
+    """
+
+    text = ("Lorem ipsum {dolor} sit amet, consectetur adipiscing elit. " * (size // 60 + 1))[:size]
+    thumbnail = {'thumbnail': "data:image/jpeg;base64," + "A" * size}
+    base = {'id': 1234, 'scope': 'ORGANIZATION', 'type': 'DATA_LEAKAGE', 'occurred': '2020-01-01T00:00:00Z',
+            'verified': '2020-01-02T00:00:00Z', 'modified': '2020-01-03T00:00:00Z',
+            'published': '2020-01-04T00:00:00Z', 'summary': text, 'description': text,
+            'tags': [{'type': 'x', 'name': 'leak'}, {'type': 'y'}, {'type': 'z', 'name': 'credentials'}]}
+    cases = [
+        ("minimal", {'id': 1}, {'thumbnail': ""}),
+        ("no tags, no thumbnail key", dict(base, tags=[], linkedContentIncidents=[]), {}),
+        ("entity summary", dict(base, impactDescription=text, mitigation=text, linkedContentIncidents=[1, 2, 3],
+                                entitySummary={'source': 'paste', 'domain': 'example.com', 'sourceDate': '2020',
+                                               'type': 'PASTE', 'summaryText': text,
+                                               'dataBreach': {'title': 'breach', 'domainName': 'example.com', 'id': 9},
+                                               'secureSocketInspection': {'grade': 'A', 'issues': [1, 2]}}),
+         thumbnail),
+        ("ip address", dict(base, entitySummary={'source': 'shodan', 'summaryText': text},
+                            IpAddressEntitySummary=True,
+                            IpAddressEntity={'source': 'scan', 'type': 'IP',
+                                             'IpAddressDetails': {'ipAddress': '1.2.3.4', 'autonomousSystemNumber': 1,
+                                                                  'location': {'country': 'FR', 'city': 'Paris'}},
+                                             'ports': {'portNumber': 443, 'transport': 'tcp', 'banner': text},
+                                             'vulnerability': {'specification': {'specification': {
+                                                 'cveId': 'CVE-2020-0001', 'description': text}}}}),
+         thumbnail),
+        ("message", dict(base, MessageEntitySummary={'source': 'irc', 'conversationFragment': {
+            'server': 'irc.example.com', 'channel': '#leaks',
+            'Message': {'nickname': 'nick', 'username': 'user', 'sent': '2020', 'content': text}}}),
+         {'thumbnail': ""}),
+    ]
+    return cases
+
+def run():
+    parser = argparse.ArgumentParser(description="Check and benchmark the markdown renderer")
+    parser.add_argument("-s", "--size", type=int, default=1000000,
+                        help="length of summaries and thumbnails in bytes (default: 1000000)")
+    parser.add_argument("-n", "--number", type=int, default=20,
+                        help="renderings per measure (default: 20)")
+    args = parser.parse_args()
+
+    for size in [10, args.size]:
+        for name, incident, thumbnail in incidents(size):
+            before = legacy_ds2markdown(incident, thumbnail).thdescription
+            after = ds2markdown(incident, thumbnail).thdescription
+            if before != after:
+                sys.exit("{} ({} bytes): descriptions differ".format(name, size))
+    print("descriptions identical on {} incidents".format(2 * len(incidents(10))))
+
+    print("{:<28} {:>12} {:>12} {:>8}".format("renderings/sec", "before", "after", "speedup"))
+    for name, incident, thumbnail in incidents(args.size):
+        before = min(timeit.repeat(lambda: legacy_ds2markdown(incident, thumbnail), number=args.number, repeat=3))
+        after = min(timeit.repeat(lambda: ds2markdown(incident, thumbnail), number=args.number, repeat=3))
+        print("{:<28} {:>12,.0f} {:>12,.0f} {:>7.2f}x".format(name, args.number / before, args.number / after, before / after))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark of the observable builders: records/sec of the previous
+per-record implementation and of observables.py, on synthetic databreach
+records and intel-incident IOCs.
+
+    python3 benchmarks/observables.py [-n RECORDS] [-r REPEAT]
+"""
+
+import os
+import re
+import sys
+import argparse
+import tempfile
+import itertools
+import time
+from string import Template
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from thehive4py.models import AlertArtifact
+
+import observables
+from artifacts import ArtifactStore
+
+
+def legacy_databreach_message(ioc):
+    databreach_observable_message_template = "**Databreach record from DigitalShadows** \n\n"+\
+              "Password: $password\n\n"+\
+              "Published: $published\n\n\n\n"+\
+              "**Seen in previous breaches**\n\n"+\
+              "  - Raw text: $rawtext\n\n"+\
+              "  - Username: $username\n\n"+\
+              "  - Username & password: $usernamepassword"
+    message = Template(databreach_observable_message_template).substitute(
+        password=ioc.get('password', '-- No password found -- '),
+        published=ioc.get('published', 'None'),
+        rawtext=ioc.get('priorRowTextBreachCount', "0"),
+        username=ioc.get('priorUsernameBreachCount', "0"),
+        usernamepassword=ioc.get('priorUsernameBreachCount', "0"))
+    return message
+
+def legacy_th_dataType(type):
+    types = {
+        'IP':'ip',
+        'HOST': 'domain',
+        'URL':'url',
+        'SHA256':'hash',
+        'SHA1':'hash',
+        'MD5':'hash',
+        'FILENAME':'filename',
+        'FILEPATH':'filename',
+        'EMAIL': 'mail'
+    }
+
+    if type in types:
+        return types[type]
+    else:
+        return "other"
+
+def legacy_build_observables(observables):
+    artefacts = []
+    if observables.get('total', 0) > 0:
+        for ioc in observables.get('content'):
+            a = AlertArtifact(
+                data=ioc.get('value'),
+                dataType=legacy_th_dataType(ioc.get('type')),
+                message="Observable from DigitalShadows. \
+                    Source: {}".format(ioc.get('source')),
+                tlp=2,
+                tags=["src:DigitalShadows"]
+            )
+            artefacts.append(a)
+
+    return artefacts
+
+def legacy_build_observables_from_databreach(records, workdir, max_observables=1000):
+    artefacts = []
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        return artefacts
+
+    columns = [k for k, v in first.items() if type(v) is str]
+    count = 0
+
+    leakfile = os.path.join(workdir, 'leak.csv')
+    with open(leakfile, 'w') as leakfd:
+        leakfd.write("".join("{};".format(c) for c in columns))
+        for ioc in itertools.chain([first], records):
+            if count < max_observables:
+                a = AlertArtifact(
+                    data=ioc.get('username'),
+                    dataType="mail" if bool(re.search(r"^[A-Za-z0-9\.\+\-\_]+\@[\w\d\-\_\.]+\.[a-zA-Z]{2,3}$", ioc.get('username'))) else "other",
+                    message=legacy_databreach_message(ioc),
+                    tlp=2,
+                    tags=["src:DigitalShadows", "databreach"]
+                )
+                artefacts.append(a)
+            count += 1
+            leakfd.write("\n" + "".join("{};".format(ioc.get(c, '')) for c in columns))
+
+    return artefacts
+
+def records(n):
+    return [{'username': 'user{}@example.com'.format(i) if i % 3 else 'user{}'.format(i),
+             'password': 'secret{}'.format(i),
+             'published': '2020-01-01T00:00:00Z',
+             'priorRowTextBreachCount': i % 5,
+             'priorUsernameBreachCount': i % 7,
+             'id': i} for i in range(n)]
+
+def iocs(n):
+    types = ['IP', 'HOST', 'URL', 'SHA256', 'MD5', 'FILENAME', 'EMAIL', 'CVE']
+    return {'total': n,
+            'content': [{'type': types[i % len(types)], 'value': 'value{}'.format(i % (n // 2 or 1)),
+                         'source': 'source{}'.format(i % 4)} for i in range(n)]}
+
+def measure(build, data, count, repeat):
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix='ds2th-bench-') as workdir:
+            start = time.perf_counter()
+            build(data, workdir)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark the observable builders")
+    parser.add_argument("-n", "--records", type=int, default=100000,
+                        help="number of databreach records and IOCs (default: 100000)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="best of REPEAT runs (default: 3)")
+    args = parser.parse_args()
+
+    data = records(args.records)
+    cases = [
+        ("databreach, all records as observables",
+         lambda r, w: legacy_build_observables_from_databreach(r, w, len(r)),
+         lambda r, w: observables.build_observables_from_databreach(r, ArtifactStore(w).folder(), len(r)), data),
+        ("databreach, 1000 observables",
+         lambda r, w: legacy_build_observables_from_databreach(r, w),
+         lambda r, w: observables.build_observables_from_databreach(r, ArtifactStore(w).folder()), data),
+        ("intel-incident IOCs",
+         lambda r, w: legacy_build_observables(r),
+         lambda r, w: observables.build_observables(r), iocs(args.records)),
+    ]
+    print("{:<40} {:>14} {:>14} {:>8}".format("records/sec", "before", "after", "speedup"))
+    for name, before, after, data in cases:
+        b = measure(before, data, args.records, args.repeat)
+        a = measure(after, data, args.records, args.repeat)
+        print("{:<40} {:>14,.0f} {:>14,.0f} {:>7.2f}x".format(name, b, a, a / b))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Startup benchmark of ds2th.py: time of `import ds2th` and of `ds2th.py -h`,
+best of several fresh interpreters, and the heavy modules they load.
+requests, thehive4py, Pillow and asyncio are only to be imported by the
+code needing them; --check exits with an error when one of them is loaded,
+or when startup is slower than --max-ms.
+The configuration is config/config.py.template.
+
+    python3 benchmarks/startup.py [-r REPEAT] [--check] [--max-ms MS]
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import runpy
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# modules not to be imported by `import ds2th` and `ds2th.py -h`
+HEAVY = ['requests', 'urllib3', 'thehive4py', 'PIL', 'asyncio', 'aiohttp', 'http.server', 'DigitalShadows.api',
+         'DigitalShadows.aioapi', 'ds2markdown', 'observables', 'dsindex']
+
+COMMANDS = {
+    'import': [],
+    'help': ['-h'],
+}
+
+
+def child(command):
+
+    """
+    Import ds2th, and run `ds2th.py -h` for the help command, then write the
+    measures to stdout as JSON
+    """
+
+    start = time.perf_counter()
+    template = runpy.run_path(os.path.join(ROOT, 'config', 'config.py.template'))
+    config = types.ModuleType('config')
+    config.DigitalShadows = template['DigitalShadows']
+    config.TheHive = template['TheHive']
+    sys.modules['config'] = config
+    sys.path.insert(0, ROOT)
+
+    import ds2th
+    if COMMANDS[command]:
+        sys.argv = ['ds2th.py'] + COMMANDS[command]
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            ds2th.run()
+        except SystemExit:
+            pass
+        finally:
+            sys.stdout = stdout
+    elapsed = time.perf_counter() - start
+    json.dump({'elapsed': elapsed, 'loaded': [m for m in HEAVY if m in sys.modules]}, sys.stdout)
+
+def measure(command, repeat):
+
+    """
+    Run `command` in `repeat` fresh interpreters
+    :return: best time in the child, best time of the whole process, modules loaded
+    :rtype: tuple
+    """
+
+    best, best_process, loaded = None, None, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', command],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, cwd=ROOT)
+        process = time.perf_counter() - start
+        if proc.returncode != 0:
+            sys.exit("{} failed:\n{}".format(command, proc.stderr))
+        result = json.loads(proc.stdout.splitlines()[-1])
+        best = result['elapsed'] if best is None else min(best, result['elapsed'])
+        best_process = process if best_process is None else min(best_process, process)
+        loaded = result['loaded']
+    return best, best_process, loaded
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of ds2th.py")
+    parser.add_argument("-r", "--repeat", type=int, default=10,
+                        help="fresh interpreters per command, the best time is kept (default: 10)")
+    parser.add_argument("--check", action='store_true', default=False,
+                        help="exit with an error if a heavy module is loaded")
+    parser.add_argument("--max-ms", type=float,
+                        help="with --check, also fail if `import ds2th` takes longer")
+    args = parser.parse_args()
+
+    print("{:<8} {:>10} {:>12}  {}".format("command", "ds2th ms", "process ms", "heavy modules loaded"))
+    failures = []
+    for command in COMMANDS:
+        elapsed, process, loaded = measure(command, args.repeat)
+        print("{:<8} {:>10.1f} {:>12.1f}  {}".format(command, elapsed * 1000, process * 1000,
+                                                      ", ".join(loaded) or "-"))
+        if loaded:
+            failures.append("{}: {} loaded".format(command, ", ".join(loaded)))
+        if args.max_ms is not None and command == 'import' and elapsed * 1000 > args.max_ms:
+            failures.append("{}: {:.1f} ms > {:.1f} ms".format(command, elapsed * 1000, args.max_ms))
+
+    if args.check and failures:
+        sys.exit("\n".join(failures))
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        child(sys.argv[2])
+    else:
+        run()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import threading
+import logging
+
+
+class Checkpoint():
+
+    def __init__(self, path):
+
+        """
+        High-water mark of DigitalShadows incidents and intel-incidents
+        already fetched, persisted between runs
+        :param path: checkpoint file
+        :type path: str
+        """
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.observed = {}
+        try:
+            with open(self.path) as f:
+                self.marks = json.load(f)
+        except FileNotFoundError:
+            self.marks = {}
+
+    def since(self, type):
+
+        """
+        :param type: incident or intel-incident
+        :type type: str
+        :return: latest `published` date already fetched, None on first run
+        :rtype: str
+        """
+
+        return self.marks.get(type, {}).get('published')
+
+    def track(self, type, incidents, field='published'):
+
+        """
+        Skip incidents at the mark which were fetched by the previous run and
+        follow the new high-water mark until save(), across calls
+        :param type: incident or intel-incident
+        :type type: str
+        :param incidents: DS incidents
+        :type incidents: iterable
+        :param field: date field used in the search
+        :type field: str
+        :return: DS incidents
+        :rtype: generator
+        """
+
+        mark = self.marks.get(type, {})
+        with self.lock:
+            observed = self.observed.setdefault(type, {'published': mark.get('published'),
+                                                       'ids': list(mark.get('ids', []))})
+
+        for incident in incidents:
+            published = incident.get(field)
+            id = incident.get('id')
+            if published is not None and published == mark.get('published') and id in mark.get('ids', []):
+                continue
+            with self.lock:
+                if published is not None:
+                    if observed['published'] is None or published > observed['published']:
+                        observed['published'] = published
+                        observed['ids'] = [id]
+                    elif published == observed['published']:
+                        observed['ids'].append(id)
+            yield incident
+
+    def save(self, type):
+
+        """
+        Persist the high-water mark followed by track()
+        :param type: incident or intel-incident
+        :type type: str
+        """
+
+        with self.lock:
+            observed = self.observed.pop(type, None)
+            if observed is None or observed['published'] is None:
+                return
+            self.marks[type] = observed
+            tmp = "{}.tmp".format(self.path)
+            with open(tmp, 'w') as f:
+                json.dump(self.marks, f)
+            os.replace(tmp, self.path)
+        logging.debug("Checkpoint.save(): {} mark set to {} {}".format(type, observed['published'], observed['ids']))
@@ -2,207 +2,218 @@
 # -*- coding: utf-8 -*-
 
 import string
-from string import Template
+from string import Formatter
 import json
 
+
+class Section():
+
+    def __init__(self, template):
+
+        """
+        Markdown template parsed once into literal text and positional
+        fields, rendered by appending both to a list of chunks: values, like
+        summaries or thumbnails, are only copied by the final join
+        :param template: str.format template with numbered fields
+        :type template: str
+        """
+
+        self.parts = [(literal, None if field is None else int(field))
+                      for literal, field, _, _ in Formatter().parse(template)]
+
+    def render(self, out, *values):
+
+        """
+        :param out: chunks of the description
+        :type out: list
+        :param values: values of the fields
+        """
+
+        for literal, field in self.parts:
+            if literal:
+                out.append(literal)
+            if field is not None:
+                value = values[field]
+                out.append(value if type(value) is str else format(value))
+
+
+HEADER = Section("**Scope:** {0}\n\n**Type:** {1}\n\n**Occurred:** {2}\n\n**Verified:** {3}\n\n**Modified:** {4}\n\n**Published:** {5}\n\n**Identifier:** {6}\n\n**Tags:** {7}\n\n")
+SUMMARY = Section("----\n\n#### Summary ####  \n\n{0}\n\n")
+DESCRIPTION = Section("----\n\n#### Description ####  \n\n{0}\n\n")
+IMPACT = Section("----\n\n#### Impact Description #### \n\n{0}")
+MITIGATION = Section("----\n\n#### Mitigation #### \n\n{0}")
+SOURCE_DATA = Section("\n\n----\n\n#### Source data #### \n\n```\n{0}\n```\n\n")
+IP_DETAILS = Section("\n\n----\n\n#### IP address details #### \n\n**IP:** {0}\n\n**AS:** {1}\n\n**Reverse Domain Name:** {2}\n\n**Service Provider:** {3}\n\n")
+GEOLOCATION = Section("**Geolocation:** {0}/{1}\n\n")
+PORT = Section("\n\n----\n\n #### Port details #### \n\n**Port:** {0}/{1}\n\n**Scanned on:** {2}\n\n**Device Type:** {3}\n\n**Banner:** {4}\n\n")
+VULNERABILITY = Section("#### vulnerability Information ####  \n\n**CVE ID:** {0}\n\n**CVE description:** {1}\n\n**Severity:** {2}\n\n**Mitigation:** {3}\n\n")
+CONVERSATION = Section("#### Conversation Information #### \n\n**Server:** {0}\n\n**Channel:** {1}\n\n")
+MESSAGE = Section("**Message**\n\n**User:** \"{0}\" - {1}\n\n**Sent:** {2}\n\n**Message**\n\n```\n\n{3}\n\n```")
+SOURCE_INFORMATION = Section("----\n\n#### Source Information #### \n\n**Source:** {0}\n\n**Domain:** {1}\n\n**Date:** {2}\n\n**Type:** {3}\n\n")
+THUMBNAIL = Section("![thumbnail][thumb]\n\n[thumb]: {0}\n\n")
+ATTACHMENTS = Section("**Images:** attached to the alert as {0}\n\n")
+DATABREACH = Section("----\n\n#### Databreach target ####  \n\n**Title:** {0}\n\n**Target domain:** {1}\n\n**Published:** {2}\n\n**Occured:** {3}\n\n**Modified:** {4}\n\n**Id:** {5}\n\n")
+TECHNICAL = Section("----\n\n#### Technical information #### \n\n ```\n\n{0}\n\n```")
+LINKED_INCIDENTS = Section("----\n\n#### Linked incidents #### \n\n")
+LINKED_INCIDENT = Section("- {0} \n\n")
+
+
 class ds2markdown():
 
     def __init__(self, content, thumbnail):
         self.thumbnail = thumbnail
         self.source = ""
-        self.thdescription = "{0} {1} {2} {3} {4} {5} {6}".format(
-            "**Scope:** {0}\n\n**Type:** {1}\n\n**Occurred:** {2}\n\n**Verified:** {3}\n\n**Modified:** {4}\n\n**Published:** {5}\n\n**Identifier:** {6}\n\n**Tags:** {7}\n\n".format(
-                    content.get('scope',"None"),
-                    content.get('type',"None"),
-                    content.get('occurred',"None"),
-                    content.get('verified',"None"),
-                    content.get('modified',"None"),
-                    content.get('published',"None"),
-                    str(content.get('id',"None")),
-                    self.tags(content)
-            ),"----\n\n#### Summary ####  \n\n{}\n\n".format(content.get('summary')),
-            "----\n\n#### Description ####  \n\n{}\n\n".format(content.get('description')),
-            "{}\n\n".format(self.impactDescription(content)),
-            "{}\n\n".format(self.mitigation(content)),
-            "{}\n\n".format(self.entitySummary(content)),
-            "{}\n\n".format(self.lci(content))
-
-        )
-
-
-
-    def entitySummary(self, content):
-        source = ""
+        out = []
+        HEADER.render(out,
+                      content.get('scope',"None"),
+                      content.get('type',"None"),
+                      content.get('occurred',"None"),
+                      content.get('verified',"None"),
+                      content.get('modified',"None"),
+                      content.get('published',"None"),
+                      content.get('id',"None"),
+                      self.tags(content))
+        # sections are separated by a space
+        out.append(" ")
+        SUMMARY.render(out, content.get('summary'))
+        out.append(" ")
+        DESCRIPTION.render(out, content.get('description'))
+        out.append(" ")
+        self.impactDescription(content, out)
+        out.append("\n\n ")
+        self.mitigation(content, out)
+        out.append("\n\n ")
+        self.entitySummary(content, out)
+        out.append("\n\n ")
+        self.lci(content, out)
+        out.append("\n\n")
+        self.thdescription = "".join(out)
+
+
+    def entitySummary(self, content, out):
+        start = len(out)
         if 'entitySummary' in content:
             c = content.get('entitySummary',"None")
-            source += self.information(c)
+            self.information(c, out)
 
             if 'summaryText' in c:
-                summaryText = c.get('summaryText',"None")
-                source += "\n\n----\n\n#### Source data #### \n\n" + \
-                        "```\n{}\n```\n\n".format(summaryText)
+                SOURCE_DATA.render(out, c.get('summaryText',"None"))
 
         if 'IpAddressEntitySummary' in content:
             c = content.get('IpAddressEntity',"None")
-            source = self.information(c)
+            # replaces the information of entitySummary
+            del out[start:]
+            self.information(c, out)
 
             if 'IpAddressDetails' in c:
                 details = c.get('IpAddressDetails',"None")
-                source += "\n\n----\n\n" + \
-                        "#### IP address details #### \n\n" + \
-                        "**IP:** {0}\n\n**AS:** {1}\n\n**Reverse Domain Name:** {2}\n\n**Service Provider:** {3}\n\n".format(
-                            details.get('ipAddress',"None"),
-                            details.get('autonomousSystemNumber',"None"),
-                            details.get('reverseDomainName',"None"),
-                            details.get('serviceProvider',"None")
-                             )
+                IP_DETAILS.render(out,
+                                  details.get('ipAddress',"None"),
+                                  details.get('autonomousSystemNumber',"None"),
+                                  details.get('reverseDomainName',"None"),
+                                  details.get('serviceProvider',"None"))
                 if 'location' in details:
-                    source += "**Geolocation:** " + details['location']['country'] + \
-                                +"/"+ details['location']['city'] + "\n\n"
+                    GEOLOCATION.render(out, details['location']['country'], details['location']['city'])
 
             if 'ports' in  c:
                 port = c['ports']
-                source += "\n\n----\n\n" + \
-                        " #### Port details #### \n\n" + \
-                        "**Port:** {0}/{1}\n\n**Scanned on:** {2}\n\n**Device Type:** {3}\n\n**Banner:** {4}\n\n".format(
+                PORT.render(out,
                             port.get('portNumber',"None"),
                             port.get('transport',"None"),
                             port.get('scannedOn',"None"),
                             port.get('deviceType',"None"),
-                            port.get('banner',"None")
-                        )
+                            port.get('banner',"None"))
 
             if 'vulnerability' in  c:
                 vuln = c.get('vulnerability').get('specification').get('specification')
-                source += "#### vulnerability Information ####  \n\n**CVE ID:** {0}\n\n**CVE description:** {1}\n\n**Severity:** {2}\n\n**Mitigation:** {3}\n\n".format(
-                        vuln.get('cveId',"None"),
-                        vuln.get('description',"None"),
-                        vuln.get('severity',"None"),
-                        vuln.get('mitigation',"None")
-                )
+                VULNERABILITY.render(out,
+                                     vuln.get('cveId',"None"),
+                                     vuln.get('description',"None"),
+                                     vuln.get('severity',"None"),
+                                     vuln.get('mitigation',"None"))
 
         if 'MessageEntitySummary' in content:
             c = content['MessageEntitySummary']
-            source += self.information(c)
+            self.information(c, out)
 
             if 'conversationFragment' in c:
                 conv = c.get('conversationFragment')
-                source += "#### Conversation Information #### \n\n**Server:** {0}\n\n**Channel:** {1}\n\n".format(
-                        conv.get('server',"None"),
-                        conv.get('channel',"None")
-                )
+                CONVERSATION.render(out, conv.get('server',"None"), conv.get('channel',"None"))
                 if "Message" in conv:
                     msg = conv.get("Message")
-                    source += "**Message**\n\n" + \
-                            "**User:** " + \
-                            "\"{0}\" - {1}\n\n**Sent:** {2}\n\n**Message**\n\n```\n\n{3}\n\n```".format(
-                                msg.get('nickname',"None"),
-                                msg.get('username',"None"),
-                                msg.get('sent',"None"),
-                                msg.get('content',"None")
-                                )
-
-        return source
-
-
-    def information(self, content):
-        source = ""
+                    MESSAGE.render(out,
+                                   msg.get('nickname',"None"),
+                                   msg.get('username',"None"),
+                                   msg.get('sent',"None"),
+                                   msg.get('content',"None"))
+
+
+    def information(self, content, out):
+        SOURCE_INFORMATION.render(out,
+                                  content.get('source',"None"),
+                                  content.get('domain',"None"),
+                                  content.get('sourceDate',"None"),
+                                  content.get('type',"None"))
         if self.thumbnail.get('thumbnail') != "":
-            source += "----\n\n" + \
-                "#### Source Information #### \n\n" + \
-                "**Source:** {0}\n\n**Domain:** {1}\n\n**Date:** {2}\n\n**Type:** {3}\n\n![thumbnail][thumb]\n\n[thumb]: {4}\n\n".format(
-                        content.get('source',"None"),
-                        content.get('domain',"None"),
-                        content.get('sourceDate',"None"),
-                        content.get('type',"None"),
-                        self.thumbnail.get('thumbnail', "None")
-                )
-        else:
-            source += "----\n\n" + \
-                "#### Source Information #### \n\n" + \
-                "**Source:** {0}\n\n**Domain:** {1}\n\n**Date:** {2}\n\n**Type:** {3}\n\n".format(
-                        content.get('source',"None"),
-                        content.get('domain',"None"),
-                        content.get('sourceDate',"None"),
-                        content.get('type',"None")
-                )
+            THUMBNAIL.render(out, self.thumbnail.get('thumbnail', "None"))
+        if self.thumbnail.get('attachments'):
+            ATTACHMENTS.render(out, ", ".join(self.thumbnail.get('attachments')))
 
         if 'dataBreach' in content:
             dataBreach = content.get('dataBreach')
-
-            source += "----\n\n#### Databreach target ####  \n\n" + \
-                        "**Title:** {0}\n\n**Target domain:** {1}\n\n**Published:** {2}\n\n**Occured:** {3}\n\n**Modified:** {4}\n\n**Id:** {5}\n\n".format(
-                                dataBreach.get('title',"None"),
-                                dataBreach.get('domainName',"None"),
-                                dataBreach.get('published',"None"),
-                                dataBreach.get('occurred',"None"),
-                                dataBreach.get('modified',"None"),
-                                dataBreach.get('id', "None")
-                        )
+            DATABREACH.render(out,
+                              dataBreach.get('title',"None"),
+                              dataBreach.get('domainName',"None"),
+                              dataBreach.get('published',"None"),
+                              dataBreach.get('occurred',"None"),
+                              dataBreach.get('modified',"None"),
+                              dataBreach.get('id', "None"))
 
         if 'secureSocketInspection' in content:
-            source += "----\n\n#### Technical information #### \n\n ```\n\n{}\n\n```".format( json.dumps(content.get('secureSocketInspection'),  indent=4))
-
+            TECHNICAL.render(out, json.dumps(content.get('secureSocketInspection'),  indent=4))
 
-        return source
 
-
-    def impactDescription(self, content):
-        impact = ""
+    def impactDescription(self, content, out):
         if "impactDescription" in content:
-            impact = "----\n\n#### Impact Description #### \n\n{}" .format(
-                    content.get('impactDescription', "None")
-            )
-
-        return impact
+            IMPACT.render(out, content.get('impactDescription', "None"))
 
-    def mitigation(self, content):
-        mitigation = ""
+    def mitigation(self, content, out):
         if "mitigation" in content:
-            mitigation = "----\n\n#### Mitigation #### \n\n{}".format(content.get('mitigation', "None"))
-        return mitigation
+            MITIGATION.render(out, content.get('mitigation', "None"))
 
 
-    def lci(self, content):
-        linkedContentIncidents = "----\n\n#### Linked incidents #### \n\n"
+    def lci(self, content, out):
+        LINKED_INCIDENTS.render(out)
         if content.get("linkedContentIncidents"):
             for lci in content["linkedContentIncidents"]:
-                linkedContentIncidents += "- {} \n\n".format(lci)
+                LINKED_INCIDENT.render(out, lci)
         else:
-            linkedContentIncidents += "None"
-        return linkedContentIncidents
+            out.append("None")
 
 
     def tags(self, content):
         if 'tags' in content:
-            t = ""
-            for tag in content['tags']:
-                if tag.get('name'):
-                    if t != "":
-                        t +=", "
-                    t += "_{}_".format(tag['name'])
-            return t
+            return ", ".join("_{}_".format(tag['name']) for tag in content['tags'] if tag.get('name'))
         return "-"
 
+databreach_observable_message_template = "**Databreach record from DigitalShadows** \n\n"+\
+          "Password: {password}\n\n"+\
+          "Published: {published}\n\n\n\n"+\
+          "**Seen in previous breaches**\n\n"+\
+          "  - Raw text: {rawtext}\n\n"+\
+          "  - Username: {username}\n\n"+\
+          "  - Username & password: {usernamepassword}"
+
 def databreach_message(ioc):
     """
     Return description for an observable created from a databreach record
     :param ioc: dict
     :return: str
     """
-    databreach_observable_message_template = "**Databreach record from DigitalShadows** \n\n"+\
-              "Password: $password\n\n"+\
-              "Published: $published\n\n\n\n"+\
-              "**Seen in previous breaches**\n\n"+\
-              "  - Raw text: $rawtext\n\n"+\
-              "  - Username: $username\n\n"+\
-              "  - Username & password: $usernamepassword"
-    message = Template(databreach_observable_message_template).substitute(
+    message = databreach_observable_message_template.format(
         password=ioc.get('password', '-- No password found -- '),
         published=ioc.get('published', 'None'),
         rawtext=ioc.get('priorRowTextBreachCount', "0"),
         username=ioc.get('priorUsernameBreachCount', "0"),
         usernamepassword=ioc.get('priorUsernameBreachCount', "0"))
     return message
-
-
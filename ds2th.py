@@ -2,21 +2,53 @@
 # -*- coding: utf-8 -*-
 
 import os
-import sys
 import re
+import sys
+import mimetypes
 import argparse
+import functools
 import datetime
+import threading
+import time
+import random
+import signal
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from io import BytesIO
 import base64
 import logging
 
-from DigitalShadows.api import DigitalShadowsApi
-from thehive4py.api import TheHiveApi
-from thehive4py.models import Alert, AlertArtifact
-
+# requests, thehive4py and the modules using them are imported by the
+# functions needing them, so that --help and runs finding nothing start fast
 
 from config import DigitalShadows,TheHive
-from ds2markdown import ds2markdown, databreach_message
+from checkpoint import Checkpoint
+from thumbnails import ThumbnailCache, ThumbnailShrinker
+from artifacts import ArtifactStore
+import metrics
+from tracing import tracer
+from tenants import load_tenants, select_tenants
+
+thumbnail_cache = ThumbnailCache(DigitalShadows.get('thumbnail_cache_size', 16 * 1024 * 1024),
+                                 DigitalShadows.get('thumbnail_cache_dir'),
+                                 DigitalShadows.get('thumbnail_cache_disk_size', 256 * 1024 * 1024))
+thumbnail_shrinker = ThumbnailShrinker(DigitalShadows.get('thumbnail_max_dimension', 0),
+                                       DigitalShadows.get('thumbnail_format', 'JPEG'),
+                                       DigitalShadows.get('thumbnail_quality', 75),
+                                       DigitalShadows.get('thumbnail_max_bytes', 0))
+artifact_store = ArtifactStore(DigitalShadows.get('artifact_dir'),
+                               DigitalShadows.get('artifact_quota', 1024 * 1024 * 1024))
+
+STAGE_SECONDS = metrics.Histogram('ds2th_stage_seconds',
+                                  "Time spent in each stage: find and databreach_records per page, thumbnail "
+                                  "downloads, iocs, markdown rendering and thehive_create per alert", ['stage'])
+ALERT_BYTES = metrics.Histogram('ds2th_alert_bytes', "Size of the alerts sent to TheHive", buckets=metrics.BYTES)
+ALERTS = metrics.Counter('ds2th_alerts_total', "Alerts submitted to TheHive by outcome", ['outcome'])
+POLL_SECONDS = metrics.Histogram('ds2th_poll_seconds', "Duration of find and daemon cycles", ['tenant', 'type'])
+LAST_POLL = metrics.Gauge('ds2th_last_poll_timestamp_seconds', "End of the last find or daemon cycle",
+                          ['tenant', 'type'])
+POLL_FAILURES = metrics.Counter('ds2th_poll_failures_total', "Daemon cycles which failed", ['tenant', 'type'])
+POLL_INTERVAL = metrics.Gauge('ds2th_poll_interval_seconds', "Interval between daemon cycles", ['tenant', 'type'])
 
 class monitoring():
     
@@ -34,6 +66,58 @@ class monitoring():
             open(self.monitoring_file, 'a').close()
 
 
+class Progress():
+
+    def __init__(self, type, total, out=sys.stderr, interval=2):
+
+        """
+        Counts of a bulk import, written to `out` at most every `interval`
+        seconds, see inc --incidents-file
+        :param type: incident or intel-incident
+        :type type: str
+        :param total: number of ids
+        :type total: int
+        """
+
+        self.type = type
+        self.total = total
+        self.out = out
+        self.interval = interval
+        self.counts = {'fetched': 0, 'missing': 0, 'created': 0, 'duplicate': 0, 'failed': 0}
+        self.start = time.time()
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def add(self, outcome):
+
+        """
+        :param outcome: fetched or missing for ids, created, duplicate or failed for alerts
+        :type outcome: str
+        """
+
+        with self.lock:
+            self.counts[outcome] += 1
+            now = time.time()
+            if now - self.last < self.interval:
+                return
+            self.last = now
+        self.write()
+
+    def write(self, end=False):
+        with self.lock:
+            line = "{}: {}/{} fetched, {} missing; alerts {} created, {} duplicate, {} failed ({:.0f}s)".format(
+                self.type, self.counts['fetched'], self.total, self.counts['missing'], self.counts['created'],
+                self.counts['duplicate'], self.counts['failed'], time.time() - self.start)
+            if self.out.isatty():
+                self.out.write("\r" + line + ("\n" if end else ""))
+            else:
+                self.out.write(line + "\n")
+            self.out.flush()
+
+    def done(self):
+        self.write(end=True)
+
+
 def add_tags(tags, content):
     
     """
@@ -66,6 +150,15 @@ def th_alert_tags(incident):
 
     return tags
 
+SEVERITIES = {
+    'NONE':1,
+    'VERY_LOW':1,
+    'LOW':1,
+    'MEDIUM':2,
+    'HIGH':3,
+    'VERY_HIGH':3
+}
+
 def th_severity(sev):
     
     """
@@ -76,42 +169,7 @@ def th_severity(sev):
     :return TH severity
     :rtype: int
     """
-    severities = {
-        'NONE':1,
-        'VERY_LOW':1,
-        'LOW':1,
-        'MEDIUM':2,
-        'HIGH':3,
-        'VERY_HIGH':3
-    }
-    return severities[sev]
-
-def th_dataType(type):
-    
-    """
-    convert DigitalShadows IOC type to TH dataType
-    :param type: DS type
-    :type type: str
-    :return: TH dataType
-    :rtype: str
-    """
-   
-    types = {
-        'IP':'ip',
-        'HOST': 'domain',
-        'URL':'url',
-        'SHA256':'hash',
-        'SHA1':'hash',
-        'MD5':'hash',
-        'FILENAME':'filename',
-        'FILEPATH':'filename',
-        'EMAIL': 'mail'
-    }
-
-    if type in types:
-        return types[type]
-    else:
-        return "other"
+    return SEVERITIES[sev]
 
 def add_alert_artefact(artefacts, dataType, data, tags, tlp):
     
@@ -124,6 +182,8 @@ def add_alert_artefact(artefacts, dataType, data, tags, tlp):
     :rtype: array
     """
 
+    from thehive4py.models import AlertArtifact
+
     return artefacts.append(AlertArtifact(tags=tags,
                              dataType=dataType,
                              data=data,
@@ -132,256 +192,461 @@ def add_alert_artefact(artefacts, dataType, data, tags, tlp):
                             )
 
 
-def build_observables(observables):
-    
-    """
-    Convert DS observables into TheHive observables
-    :param observables: observables from DS
-    :type observables: dict
-    :return: AlertArtifact
-    :rtype: thehive4py.models AlertArtifact
-    """
-
-    artefacts = []
-    if observables.get('total', 0) > 0:
-        for ioc in observables.get('content'):
-            a = AlertArtifact(
-                data=ioc.get('value'),
-                dataType=th_dataType(ioc.get('type')),
-                message="Observable from DigitalShadows. \
-                    Source: {}".format(ioc.get('source')),
-                tlp=2,
-                tags=["src:DigitalShadows"]
-            )
-            artefacts.append(a)
-
-    return artefacts
-
-def databreach_list(iocs):
-    """
-    Return str content for csv file
-    :param iocs:
-    :return:
-    """
-    csv = ''
-    index=[]
-    if len(iocs) > 0 and type(iocs[0] is dict):
-        for k, v in iocs[0].items():
-            if type(v) is str:
-                csv += f"{k};"
-                index.append(k)
-    for ioc in iocs:
-        csv += "\n"
-        for i in index:
-            csv += f"{ioc.get(i, '')};"
-    return csv
-
-def build_observables_from_databreach(observables):
-    """
-    Convert DS observables into TheHive observables
-    :param observables: observables from DS
-    :type observables: dict
-    :return: AlertArtifact
-    :rtype: thehive4py.models AlertArtifact
-    """
-
-    artefacts = []
-    if observables.get('total', 0) > 0:
-        for ioc in observables.get('content'):
-            a = AlertArtifact(
-                data=ioc.get('username'),
-                dataType="mail" if bool(re.search(r"^[A-Za-z0-9\.\+\-\_]+\@[\w\d\-\_\.]+\.[a-zA-Z]{2,3}$", ioc.get('username'))) else "other",
-                message=databreach_message(ioc),
-                tlp=2,
-                tags=["src:DigitalShadows", "databreach"]
-            )
-            artefacts.append(a)
-
-        leakfile = '/tmp/leak.csv'
-        leakfd = open( leakfile, 'w')
-        leakfd.write(databreach_list(observables.get('content')))
-        leakfd.close()
-
-        artefacts.append(AlertArtifact(dataType="file",
-                                       data=leakfile,
-                                       message="List of records from DigitalShadows",
-                                       tlp=2,
-                                       tags=["src:DigitalShadows", "databreach"])
-                         )
-
-    return artefacts
-
-def build_alert(incident, type, observables, thumbnail):
+def build_alert(incident, type, observables, thumbnail, folder, images=None, thehive=TheHive):
     
     """
     Convert DigitalShadows alert into a TheHive Alert
 
     :param incident: Incident from DS
     :type incident: dict
-    :param observables: observables from DS
-    :type observables: dict
+    :param observables: observables from DS, or records for databreaches
+    :type observables: dict or iterable
     :type thumbnail: str
+    :param folder: files of the alert, released once they are read
+    :type folder: artifacts.ArtifactFolder
+    :param images: screenshot and thumbnail files, see download_images()
+    :type images: list
+    :param thehive: TheHive config of the tenant
+    :type thehive: dict
     :return: Thehive alert
     :rtype: thehive4py.models Alerts
     """
 
+    from thehive4py.models import Alert
+    from ds2markdown import ds2markdown
+    from observables import build_observables, build_observables_from_databreach
 
-    template = TheHive.get('templates').get(incident.get('type'), 'default')
+    template = thehive.get('templates').get(incident.get('type'), 'default')
+    # TheHive 4 accepts files added to an existing alert, they are uploaded
+    # by submit_alert() instead of being embedded in the alert
+    lazy = bool(images) and thehive.get('version', 3) >= 4
+    if images:
+        thumbnail = dict(thumbnail, attachments=[os.path.basename(f) for f in images])
 
-    if type in ['incident', 'intel-incident']:
-        obs=build_observables(observables)
-    elif type in ['databreach']:
-        obs = build_observables_from_databreach(observables.get('data'))
-
-    a = Alert(title="{}".format(incident.get('title')),
-                 tlp=2,
-                 severity=th_severity(incident.get('severity')),
-                 description=ds2markdown(incident, thumbnail).thdescription,
-                 type=incident.get('type'),
-                 tags=th_alert_tags(incident),
-                 caseTemplate=template,
-                 source="DigitalShadows",
-                 sourceRef=str(incident.get('id')),
-                 artifacts=obs
-                 )
+    # files are read when the Alert is built, so the folder of the alert is
+    # removed right after, unless images are left to submit_alert()
+    try:
+        with tracer.span('build_alert', id=incident.get('id')):
+            if type in ['incident', 'intel-incident']:
+                obs=build_observables(observables)
+            elif type in ['databreach']:
+                obs = build_observables_from_databreach(observables, folder,
+                                                        DigitalShadows.get('databreach_max_observables', 1000),
+                                                        DigitalShadows.get('databreach_max_merged', 10))
+            if images and not lazy:
+                obs.extend(image_artifact(f) for f in images)
+            with STAGE_SECONDS.time(stage='markdown'), tracer.span('ds2markdown', id=incident.get('id')):
+                description = ds2markdown(incident, thumbnail).thdescription
+
+            a = Alert(title="{}".format(incident.get('title')),
+                         tlp=2,
+                         severity=th_severity(incident.get('severity')),
+                         description=description,
+                         type=incident.get('type'),
+                         tags=th_alert_tags(incident),
+                         caseTemplate=template,
+                         source="DigitalShadows",
+                         sourceRef=str(incident.get('id')),
+                         artifacts=obs
+                         )
+    except BaseException:
+        folder.release()
+        raise
+    if lazy:
+        a.attachments = (folder, images)
+    else:
+        folder.release()
     logging.debug("build_alert: alert built for DS id #{}".format(incident.get('id')))
     return a
 
-def find_incidents(dsapi, since):
-    
+IMAGES = [('screenshot', 'screenshotId'), ('thumbnail', 'screenshotThumbnailId')]
+
+def image_ids(incident):
+
+    """
+    :param incident: DS incident or intel-incident
+    :type incident: dict
+    :return: kind and id of the screenshot and thumbnail of the incident
+    :rtype: list
     """
+
+    entity = incident.get('entitySummary') or {}
+    return [(kind, entity.get(key)) for kind, key in IMAGES if entity.get(key)]
+
+def image_path(folder, kind, id):
+    return folder.path("{}-{}".format(kind, re.sub(r'[^\w\-]', '_', str(id))))
+
+def named_image(folder, path, content_type):
+
+    """
+    Count a downloaded image in the artifact quota and add the extension of
+    `content_type` to its name
+    :return: path of the image, None if it was not downloaded or is over quota
+    :rtype: str
+    """
+
+    if content_type is not None and not folder.add(path):
+        return None
+    if content_type is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    extension = mimetypes.guess_extension(content_type.split(';')[0].strip()) or ''
+    os.replace(path, path + extension)
+    return path + extension
+
+def download_images(dsapi, incident, folder):
+
+    """
+    Stream the screenshot and the thumbnail of a DS incident to the folder
+    of its alert, to be attached to the alert as files
     :param dsapi: DigitalShadows.api.DigitalShadowsApi
-    :param since: number of minutes
-    :type since: int
-    :return: list of  thehive4py.models Alerts
-    :rtype: array
+    :type incident: dict
+    :type folder: artifacts.ArtifactFolder
+    :return: image files
+    :rtype: list
     """
-    inc_type = "incident"
 
-    s = "{}/{}".format((datetime.datetime.utcnow() - datetime.timedelta(minutes=int(since))).isoformat(),
-                       datetime.datetime.utcnow().isoformat())
-    response = dsapi.find_incidents(s)
+    images = []
+    for kind, id in image_ids(incident):
+        save = dsapi.save_screenshot if kind == 'screenshot' else dsapi.save_thumbnail
+        path = image_path(folder, kind, id)
+        images.append(named_image(folder, path, save(id, path)))
+    return [i for i in images if i is not None]
 
-    if response.get('status') == "success":
-        data = response.get('data')
-        logging.debug('find_incidents(): {} DS incident(s) downloaded'.format(data.get('total')))
+def image_artifact(path):
 
-        for i in data.get('content'):
-            iocs = {}
-            # add records for databreaches
-            if i.get('entitySummary') and i.get('entitySummary').get('screenshotThumbnailId'):
-                thumbnail = build_thumbnail(dsapi, i.get('entitySummary').get('screenshotThumbnailId'))
-            else:
-                thumbnail = {'thumbnail':""}
+    """
+    :param path: screenshot or thumbnail file
+    :type path: str
+    :return: file observable
+    :rtype: thehive4py.models AlertArtifact
+    """
+
+    from thehive4py.models import AlertArtifact
+
+    return AlertArtifact(dataType="file",
+                         data=path,
+                         message="Image from DigitalShadows",
+                         tlp=2,
+                         tags=["src:DigitalShadows"])
+
+def enrich_incident(dsapi, incident, inc_type, thehive=TheHive):
+
+    """
+    Fetch thumbnail and observables of a DS incident or intel-incident and
+    build the TheHive alert
+    :param dsapi: DigitalShadows.api.DigitalShadowsApi
+    :param incident: DS incident or intel-incident
+    :type incident: dict
+    :param inc_type: incident or intel-incident
+    :type inc_type: str
+    :param thehive: TheHive config of the tenant
+    :type thehive: dict
+    :return: TheHive alert
+    :rtype: thehive4py.models Alert
+    """
+
+    iocs = {}
+    images = []
+    folder = artifact_store.folder()
+    try:
+        # Add Thumbnail or screenshot if exist
+        if DigitalShadows.get('attach_images', False):
+            thumbnail = {'thumbnail': ""}
+            with tracer.span('download_images', id=incident.get('id')):
+                images = download_images(dsapi, incident, folder)
+        elif incident.get('entitySummary') and incident.get('entitySummary').get('screenshotThumbnailId'):
+            with tracer.span('build_thumbnail', id=incident.get('id')):
+                thumbnail = build_thumbnail(dsapi, incident.get('entitySummary').get('screenshotThumbnailId'))
+        else:
+            thumbnail = {'thumbnail': ""}
 
+        if inc_type == "intel-incident":
+            with STAGE_SECONDS.time(stage='iocs'), tracer.span('get_intel_incident_iocs', id=incident.get('id')):
+                iocs = dsapi.get_intel_incident_iocs(incident.get('id')).json()
+        elif incident.get('entitySummary') and incident.get('entitySummary').get('dataBreach'):
             # add records for databreaches
-            if data.get('entitySummary') and data.get('entitySummary').get('dataBreach'):
-                inc_type = "databreach"
-                iocs = dsapi.get_databreach_records(data.get('entitySummary') and data.get('entitySummary').get('dataBreach').get('id'))
+            inc_type = "databreach"
+            iocs = databreach_records(dsapi, incident.get('entitySummary').get('dataBreach').get('id'))
+    except BaseException:
+        folder.release()
+        raise
 
+    return build_alert(incident, inc_type, iocs, thumbnail, folder, images, thehive)
 
-            yield build_alert(i, inc_type, iocs, thumbnail)
-    else:
-        logging.debug("find_incidents(): Error while fetching incident #{}: {}".format(id, response.get('data')))
-        sys.exit("find_incidents(): Error while fetching incident #{}: {}".format(id, response.get('data')))
+def enrich_incidents(dsapi, incidents, inc_type, thehive=TheHive):
+
+    """
+    Enrich DS incidents concurrently with `max_workers` threads. Alerts are
+    yielded in the same order as `incidents`, which is consumed lazily.
+    :param dsapi: DigitalShadows.api.DigitalShadowsApi
+    :param incidents: DS incidents or intel-incidents
+    :type incidents: iterable
+    :param inc_type: incident or intel-incident
+    :type inc_type: str
+    :param thehive: TheHive config of the tenant
+    :type thehive: dict
+    :return: TheHive alerts
+    :rtype: generator
+    """
+
+    workers = DigitalShadows.get('max_workers', 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for incident in incidents:
+            pending.append(executor.submit(enrich_incident, dsapi, incident, inc_type, thehive))
+            # keep a bounded number of incidents ahead of the consumer
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def read_ids(file):
+
+    """
+    Read incident ids from a file, i.e. a column exported from a spreadsheet:
+    ids are separated by spaces, commas, semicolons or new lines, anything
+    else than a number (headers) is ignored
+    :param file: opened file, or stdin
+    :type file: file
+    :return: ids without duplicates, in the order of the file
+    :rtype: list
+    """
+
+    ids = {}
+    for line in file:
+        for token in re.split(r'[\s,;]+', line.strip()):
+            if token.isdigit():
+                ids[int(token)] = None
+            elif token:
+                logging.debug("read_ids(): {} ignored, not an id".format(token))
+    return list(ids)
+
+def lookup(get, ids):
+
+    """
+    Fetch incidents by id `max_in_flight` at a time, with at most
+    `page_size` ids ahead of the consumer. The search endpoints have no id
+    filter, so each id is still one request.
+    :param get: dsapi.get_incident or dsapi.get_intel_incident
+    :type get: function
+    :param ids: incident ids
+    :type ids: iterable
+    :return: id and response, in the order of `ids`
+    :rtype: generator
+    """
 
-def get_incidents(dsapi, id_list):
+    def fetch(id):
+        with tracer.span(get.__name__, id=id):
+            return get(id)
+
+    window = DigitalShadows.get('page_size', 50)
+    with ThreadPoolExecutor(max_workers=DigitalShadows.get('max_in_flight', 8)) as executor:
+        pending = deque()
+        for id in ids:
+            pending.append((id, executor.submit(fetch, id)))
+            if len(pending) >= window:
+                id, future = pending.popleft()
+                yield id, future.result()
+        while pending:
+            id, future = pending.popleft()
+            yield id, future.result()
+
+def date_range(since, start=None):
+
+    """
+    Return a DigitalShadows dateRange ending now
+    :param since: number of minutes, used when there is no start
+    :type since: int
+    :param start: start date
+    :type start: str
+    :return: dateRange
+    :rtype: str
+    """
+
+    now = datetime.datetime.utcnow()
+    if start is None:
+        start = (now - datetime.timedelta(minutes=int(since))).isoformat()
+    return "{}/{}".format(start, now.isoformat())
+
+def find_incidents(dsapi, since, index=None, checkpoint=None, thehive=TheHive):
+    
+    """
+    :param dsapi: DigitalShadows.api.DigitalShadowsApi
+    :param since: number of minutes
+    :type since: int
+    :param index: incidents already forwarded are skipped before enrichment
+    :type index: dsindex.ForwardedIndex
+    :param checkpoint: search from the last mark instead of `since` minutes
+    :type checkpoint: checkpoint.Checkpoint
+    :param thehive: TheHive config of the tenant
+    :type thehive: dict
+    :return: thehive4py.models Alerts, streamed page after page
+    :rtype: generator
+    """
+
+    if dsapi.asynchronous:
+        return dsapi.iterate(async_find_alerts(dsapi, "incident", since, index, checkpoint, thehive))
+
+    s = date_range(since, checkpoint and checkpoint.since("incident"))
+
+    def incidents():
+        pages = dsapi.paginate(dsapi.find_incidents, s, stream=dsapi.streaming)
+        for response in tracer.spans('find_incidents', metrics.timed(STAGE_SECONDS, pages, stage='find')):
+            if response.get('status') != "success":
+                logging.debug("find_incidents(): Error while searching incidents since {}: {}".format(s, response.get('data')))
+                sys.exit("find_incidents(): Error while searching incidents since {}: {}".format(s, response.get('data')))
+
+            data = response.get('data')
+            count = 0
+            for i in data.get('content'):
+                count += 1
+                yield i
+            logging.debug('find_incidents(): {} of {} DS incident(s) downloaded'.format(count, data.get('total')))
+
+    found = incidents()
+    if checkpoint is not None:
+        found = checkpoint.track("incident", found)
+    if index is not None:
+        found = index.filter("incident", found)
+    return enrich_incidents(dsapi, found, "incident", thehive)
+
+def get_incidents(dsapi, id_list, index=None, force=False, progress=None, thehive=TheHive):
     
     """
     :type dsapi: DigitalShadows.api.DigitalShadowsApi
     :param id_list: list of incident id
     :type id_list: array
+    :param index: incidents already forwarded and not modified since are skipped
+    :type index: dsindex.ForwardedIndex
+    :param force: do not skip incidents already forwarded
+    :type force: bool
+    :param progress: counts lookups, incidents which can't be fetched are then skipped
+    :type progress: Progress
+    :param thehive: TheHive config of the tenant
+    :type thehive: dict
     :return: TheHive alert
     :rtype: thehive4py.models Alert
     
     """
-    inc_type = "incident"
 
-    while id_list:
-        iocs = {}
-        id = id_list.pop()
-        response = dsapi.get_incident(id)
-        if response.get('status') == 'success':
-            data = response.get('data')
-            logging.debug('get_incidents(): DS incident {} fetched'.format(data.get('id')))
-
-            # Add Thumbnail or screenshot if exist
-            if data.get('entitySummary') and data.get('entitySummary').get('screenshotThumbnailId'):
-                thumbnail = build_thumbnail(dsapi, data.get('entitySummary').get('screenshotThumbnailId'))
+    if dsapi.asynchronous:
+        return dsapi.iterate(async_get_alerts(dsapi, "incident", id_list, index, force, progress, thehive))
+
+    def incidents():
+        for id, response in lookup(dsapi.get_incident, id_list):
+            if response.get('status') == 'success':
+                data = response.get('data')
+                logging.debug('get_incidents(): DS incident {} fetched{}'.format(data.get('id'), not_modified(response)))
+                if progress is not None:
+                    progress.add('fetched')
+                yield data
+            elif progress is not None:
+                logging.debug("get_incidents(): Error while fetching incident #{}: {}".format(id, response.get('data')))
+                progress.add('missing')
             else:
-                thumbnail = {'thumbnail': ""}
-
-            # add records for databreaches
-            if data.get('entitySummary') and data.get('entitySummary').get('dataBreach'):
-                inc_type = "databreach"
-                iocs = dsapi.get_databreach_records(data.get('entitySummary') and data.get('entitySummary').get('dataBreach').get('id'))
+                logging.debug("get_incidents(): Error while fetching incident #{}: {}".format(id, response.get('data')))
+                sys.exit("get_incidents: Error while fetching incident #{}: {}".format(id, response.get('data')))
 
+    found = incidents()
+    if index is not None:
+        found = index.filter("incident", found, force)
+    return enrich_incidents(dsapi, found, "incident", thehive)
 
 
-            yield build_alert(data, inc_type, iocs, thumbnail)
-        else:
-            logging.debug("get_incidents(): Error while fetching incident #{}: {}".format(id, response.get('data')))
-            sys.exit("get_incidents: Error while fetching incident #{}: {}".format(id, response.get('data')))
-
-
-def find_intel_incidents(dsapi, since):
+def find_intel_incidents(dsapi, since, index=None, checkpoint=None, thehive=TheHive):
     
     """
     :type dsapi: DigitalShadows.api.DigitalShadowsApi
     :param since: number of minutes, period of time
     :type since: int
+    :param index: intel-incidents already forwarded are skipped before enrichment
+    :type index: dsindex.ForwardedIndex
+    :param checkpoint: search from the last mark instead of `since` minutes
+    :type checkpoint: checkpoint.Checkpoint
+    :param thehive: TheHive config of the tenant
+    :type thehive: dict
     :return: alert
     :rtype: thehive4py.models Alert
     """
-    inc_type = "intel-incident"
-    s = "{}/{}".format((datetime.datetime.utcnow() - datetime.timedelta(minutes=int(since))).isoformat(),
-                       datetime.datetime.utcnow().isoformat())
-    response = dsapi.find_intel_incidents(s)
 
-    if response.get('status') == "success":
-        data = response.get('data')
-        logging.debug('find_intel_incidents(): {} DS intel-incident(s) downloaded'.format(data.get('total')))
-        for i in data.get('content'):
-            iocs = {}
-            if i.get('entitySummary') and i.get('entitySummary').get('screenshotThumbnailId'):
-                thumbnail = build_thumbnail(dsapi, i.get('entitySummary').get('screenshotThumbnailId'))
-            else:
-                thumbnail = {'thumbnail':''}
-            iocs = dsapi.get_intel_incident_iocs(i.get('id')).json()
-            yield build_alert(i, inc_type, iocs, thumbnail)
+    if dsapi.asynchronous:
+        return dsapi.iterate(async_find_alerts(dsapi, "intel-incident", since, index, checkpoint, thehive))
 
-    else:
-        logging.debug("find_intel_incidents(): Error while searching intel-incidents since {} min: {}".format(s, response.get('data')))
-        sys.exit("find_intel_incidents(): Error while searching intel-incidents since {} min: {}".format(s, response.get('data')))
+    s = date_range(since, checkpoint and checkpoint.since("intel-incident"))
+
+    def intel_incidents():
+        pages = dsapi.paginate(dsapi.find_intel_incidents, s, stream=dsapi.streaming)
+        for response in tracer.spans('find_intel_incidents', metrics.timed(STAGE_SECONDS, pages, stage='find')):
+            if response.get('status') != "success":
+                logging.debug("find_intel_incidents(): Error while searching intel-incidents since {}: {}".format(s, response.get('data')))
+                sys.exit("find_intel_incidents(): Error while searching intel-incidents since {}: {}".format(s, response.get('data')))
 
-def get_intel_incidents(dsapi, id_list):
+            data = response.get('data')
+            count = 0
+            for i in data.get('content'):
+                count += 1
+                yield i
+            logging.debug('find_intel_incidents(): {} of {} DS intel-incident(s) downloaded'.format(count, data.get('total')))
+
+    found = intel_incidents()
+    if checkpoint is not None:
+        found = checkpoint.track("intel-incident", found)
+    if index is not None:
+        found = index.filter("intel-incident", found)
+    return enrich_incidents(dsapi, found, "intel-incident", thehive)
+
+def get_intel_incidents(dsapi, id_list, index=None, force=False, progress=None, thehive=TheHive):
     
     """
     :param dsapi: DigitalShadows api init
     :type dsapi: 
     :param id: intel-incident id
     :type id: list
+    :param index: intel-incidents already forwarded and not modified since are skipped
+    :type index: dsindex.ForwardedIndex
+    :param force: do not skip intel-incidents already forwarded
+    :type force: bool
+    :param progress: counts lookups, intel-incidents which can't be fetched are then skipped
+    :type progress: Progress
+    :param thehive: TheHive config of the tenant
+    :type thehive: dict
     :return: Thehive alert
     :rtype: thehive4py.models Alert
     """
-    inc_type = "intel-incident"
 
-    while id_list:
-        iocs = {}
-        id = id_list.pop()
-        response = dsapi.get_intel_incident(id)
-        if response.get('status') == "success":
-            data = response.get('data')
-            logging.debug('get_incidents(): DS intel-incident {} fetched'.format(data.get('id')))
-            if data.get('entitySummary') and data.get('entitySummary').get('screenshotThumbnailId'):
-                thumbnail = build_thumbnail(dsapi, data.get('entitySummary').get('screenshotThumbnailId'))
+    if dsapi.asynchronous:
+        return dsapi.iterate(async_get_alerts(dsapi, "intel-incident", id_list, index, force, progress, thehive))
+
+    def intel_incidents():
+        for id, response in lookup(dsapi.get_intel_incident, id_list):
+            if response.get('status') == "success":
+                data = response.get('data')
+                logging.debug('get_incidents(): DS intel-incident {} fetched{}'.format(data.get('id'), not_modified(response)))
+                if progress is not None:
+                    progress.add('fetched')
+                yield data
+            elif progress is not None:
+                logging.debug("Error while fetching intel-incident #{}: {}".format(id, response.get('data')))
+                progress.add('missing')
             else:
-                thumbnail = {'thumbnail': ""}
-            iocs = dsapi.get_intel_incident_iocs(data.get('id')).json()
-            yield build_alert(data, inc_type, iocs, thumbnail)
-        else:
-            logging.debug("Error while fetching intel-incident #{}: {}".format(id, response.get('data')))
-            sys.exit("Error while fetching intel-incident #{}: {}".format(id, response.get('data')))
+                logging.debug("Error while fetching intel-incident #{}: {}".format(id, response.get('data')))
+                sys.exit("Error while fetching intel-incident #{}: {}".format(id, response.get('data')))
+
+    found = intel_incidents()
+    if index is not None:
+        found = index.filter("intel-incident", found, force)
+    return enrich_incidents(dsapi, found, "intel-incident", thehive)
+
+def not_modified(response):
+
+    """
+    :return: log suffix of incidents revalidated by a conditional request
+    :rtype: str
+    """
+
+    return " (not modified)" if response.get('not_modified') else ""
 
 
 def build_thumbnail(dsapi, thumbnail_id):
@@ -395,41 +660,473 @@ def build_thumbnail(dsapi, thumbnail_id):
     :return: dict with base64 pict ready to be added in markdown
     """
 
-    response = dsapi.get_thumbnail(thumbnail_id)
-    if response.status_code == 200:
-        with BytesIO(response.content) as bytes:
+    thumbnail = thumbnail_cache.get(thumbnail_id)
+    if thumbnail is not None:
+        logging.debug("build_thumbnail(): thumbnail {} found in cache: {}".format(thumbnail_id, thumbnail_cache.stats()))
+        return {"thumbnail": thumbnail}
+
+    with STAGE_SECONDS.time(stage='thumbnail'):
+        response = dsapi.get_thumbnail(thumbnail_id)
+        if response.status_code == 200:
+            return {"thumbnail": encode_thumbnail(thumbnail_id, response.content, response.headers['Content-Type'])}
+        else:
+            return {"thumbnail": ""}
+
+def encode_thumbnail(thumbnail_id, content, content_type):
+
+    """
+    Shrink a downloaded thumbnail, encode it as a data URI and cache it
+    :type thumbnail_id: string
+    :param content: image
+    :type content: bytes
+    :type content_type: str
+    :return: base64 pict ready to be added in markdown
+    :rtype: str
+    """
+
+    content, content_type = thumbnail_shrinker.shrink(content, content_type)
+    if content is None:
+        # too big, the alert is created without thumbnail
+        thumbnail = ""
+    else:
+        with BytesIO(content) as bytes:
             encoded = base64.b64encode(bytes.read())
             b64_thumbnail = encoded.decode()
+        thumbnail = "data:{};base64,{}".format(content_type, b64_thumbnail)
 
-        return {"thumbnail":"data:{};base64,{}".format(response.headers['Content-Type'], b64_thumbnail)}
-    else:
-        return {"thumbnail": ""}
+    thumbnail_cache.put(thumbnail_id, thumbnail)
+    logging.debug("encode_thumbnail(): thumbnail {} downloaded: {} {}".format(thumbnail_id, thumbnail_cache.stats(),
+                                                                              thumbnail_shrinker.stats()))
+    return thumbnail
 
 def databreach_records(dsapi, databreach_id):
     """
-    Return list of interesting records in the databreach
+    Return list of interesting records in the databreach, streamed page after page
     :param dsapi:
     :param databreach_id:
-    :return:
+    :return: databreach records
+    :rtype: generator
+    """
+    pages = dsapi.paginate(dsapi.get_databreach_records, databreach_id,
+                           size=DigitalShadows.get('databreach_page_size', 1000), stream=dsapi.streaming)
+    pages = metrics.timed(STAGE_SECONDS, pages, stage='databreach_records')
+    for response in tracer.spans('databreach_records', pages, id=databreach_id):
+        if response.get('status') != "success":
+            logging.debug("databreach_records(): Error while fetching records of databreach #{}: {}".format(databreach_id, response.get('data')))
+            return
+        for record in response.get('data').get('content', []):
+            yield record
+
+async def async_build_thumbnail(dsapi, thumbnail_id):
+
+    """
+    build_thumbnail() for DigitalShadows.aioapi.AsyncDigitalShadowsApi
+    :return: dict with base64 pict ready to be added in markdown
+    """
+
+    import asyncio
+
+    thumbnail = thumbnail_cache.get(thumbnail_id)
+    if thumbnail is not None:
+        logging.debug("async_build_thumbnail(): thumbnail {} found in cache: {}".format(thumbnail_id, thumbnail_cache.stats()))
+        return {"thumbnail": thumbnail}
+
+    with STAGE_SECONDS.time(stage='thumbnail'):
+        response = await dsapi.get_thumbnail(thumbnail_id)
+        if response.status_code == 200:
+            thumbnail = await asyncio.get_event_loop().run_in_executor(None, encode_thumbnail, thumbnail_id,
+                                                                       response.content, response.headers['Content-Type'])
+            return {"thumbnail": thumbnail}
+        else:
+            return {"thumbnail": ""}
+
+async def async_download_images(dsapi, incident, folder):
+
+    """
+    download_images() for DigitalShadows.aioapi.AsyncDigitalShadowsApi
+    :return: image files
+    :rtype: list
     """
-    return dsapi.get_databreach_records(databreach_id)
 
-def create_thehive_alerts(config, alerts):
+    images = []
+    for kind, id in image_ids(incident):
+        save = dsapi.save_screenshot if kind == 'screenshot' else dsapi.save_thumbnail
+        path = image_path(folder, kind, id)
+        images.append(named_image(folder, path, await save(id, path)))
+    return [i for i in images if i is not None]
+
+async def async_databreach_records(dsapi, databreach_id):
+
+    """
+    databreach_records() for DigitalShadows.aioapi.AsyncDigitalShadowsApi
+    :return: databreach records
+    :rtype: async generator
+    """
+
+    from DigitalShadows.aioapi import RequestError
+
+    try:
+        pages = dsapi.paginate(dsapi.get_databreach_records, databreach_id,
+                               size=DigitalShadows.get('databreach_page_size', 1000))
+        pages = metrics.async_timed(STAGE_SECONDS, pages, stage='databreach_records')
+        async for response in tracer.async_spans('databreach_records', pages, id=databreach_id):
+            if response.get('status') != "success":
+                logging.debug("async_databreach_records(): Error while fetching records of databreach #{}: {}".format(databreach_id, response.get('data')))
+                return
+            for record in response.get('data').get('content', []):
+                yield record
+    except RequestError as e:
+        logging.debug("async_databreach_records(): Error while fetching records of databreach #{}: {}".format(databreach_id, e))
+
+async def async_enrich_incident(dsapi, incident, inc_type, thehive=TheHive):
+
+    """
+    enrich_incident() for DigitalShadows.aioapi.AsyncDigitalShadowsApi: the
+    thumbnail and the observables are fetched concurrently, the alert is
+    built in a worker thread
+    :return: TheHive alert
+    :rtype: thehive4py.models Alert
+    """
+
+    import asyncio
+
+    loop = asyncio.get_event_loop()
+    iocs = {}
+    thumbnail = {'thumbnail': ""}
+    images = []
+    entity = incident.get('entitySummary') or {}
+    folder = artifact_store.folder()
+    try:
+        if DigitalShadows.get('attach_images', False):
+            images = asyncio.ensure_future(tracer.traced('download_images', async_download_images(dsapi, incident, folder),
+                                                         id=incident.get('id')))
+        elif entity.get('screenshotThumbnailId'):
+            thumbnail = asyncio.ensure_future(tracer.traced('build_thumbnail',
+                                                            async_build_thumbnail(dsapi, entity.get('screenshotThumbnailId')),
+                                                            id=incident.get('id')))
+
+        if inc_type == "intel-incident":
+            with STAGE_SECONDS.time(stage='iocs'), tracer.span('get_intel_incident_iocs', id=incident.get('id')):
+                iocs = (await dsapi.get_intel_incident_iocs(incident.get('id'))).json()
+        elif entity.get('dataBreach'):
+            # records are streamed from the event loop to build_alert
+            inc_type = "databreach"
+            iocs = dsapi.iterate(async_databreach_records(dsapi, entity.get('dataBreach').get('id')))
+
+        if asyncio.isfuture(thumbnail):
+            thumbnail = await thumbnail
+        if asyncio.isfuture(images):
+            images = await images
+    except BaseException:
+        if asyncio.isfuture(images):
+            images.cancel()
+        folder.release()
+        raise
+    return await loop.run_in_executor(None, build_alert, incident, inc_type, iocs, thumbnail, folder, images, thehive)
+
+async def async_find_alerts(dsapi, inc_type, since, index=None, checkpoint=None, thehive=TheHive):
+
+    """
+    find_incidents() and find_intel_incidents() for
+    DigitalShadows.aioapi.AsyncDigitalShadowsApi: all the incidents of a page
+    are enriched concurrently
+    :return: TheHive alerts
+    :rtype: async generator
+    """
+
+    import asyncio
+    from DigitalShadows.aioapi import RequestError
+
+    if inc_type == "intel-incident":
+        find = dsapi.find_intel_incidents
+    else:
+        find = dsapi.find_incidents
+
+    s = date_range(since, checkpoint and checkpoint.since(inc_type))
+    pages = metrics.async_timed(STAGE_SECONDS, dsapi.paginate(find, s), stage='find')
+    async for response in tracer.async_spans(find.__name__, pages):
+        if response.get('status') != "success":
+            logging.debug("async_find_alerts(): Error while searching {}s since {}: {}".format(inc_type, s, response.get('data')))
+            raise RequestError("async_find_alerts(): Error while searching {}s since {}: {}".format(inc_type, s, response.get('data')))
+
+        data = response.get('data')
+        logging.debug('async_find_alerts(): {} of {} DS {}(s) downloaded'.format(len(data.get('content')), data.get('total'), inc_type))
+        found = data.get('content')
+        if checkpoint is not None:
+            found = checkpoint.track(inc_type, found)
+        if index is not None:
+            found = index.filter(inc_type, found)
+        tasks = [asyncio.ensure_future(async_enrich_incident(dsapi, i, inc_type, thehive)) for i in found]
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+async def async_get_alerts(dsapi, inc_type, id_list, index=None, force=False, progress=None, thehive=TheHive):
+
+    """
+    get_incidents() and get_intel_incidents() for
+    DigitalShadows.aioapi.AsyncDigitalShadowsApi: `page_size` incidents at a
+    time are fetched and enriched concurrently
+    :return: TheHive alerts
+    :rtype: async generator
+    """
+
+    import asyncio
+    from DigitalShadows.aioapi import RequestError
+
+    if inc_type == "intel-incident":
+        get = dsapi.get_intel_incident
+    else:
+        get = dsapi.get_incident
+
+    async def fetch(id):
+        with tracer.span(get.__name__, id=id):
+            response = await get(id)
+        if response.get('status') != "success":
+            logging.debug("async_get_alerts(): Error while fetching {} #{}: {}".format(inc_type, id, response.get('data')))
+            if progress is not None:
+                progress.add('missing')
+                return None
+            raise RequestError("async_get_alerts(): Error while fetching {} #{}: {}".format(inc_type, id, response.get('data')))
+        logging.debug('async_get_alerts(): DS {} {} fetched{}'.format(inc_type, id, not_modified(response)))
+        if progress is not None:
+            progress.add('fetched')
+        found = [response.get('data')]
+        if index is not None:
+            found = list(index.filter(inc_type, found, force))
+        if found:
+            return await async_enrich_incident(dsapi, found[0], inc_type, thehive)
+
+    window = DigitalShadows.get('page_size', 50)
+    tasks = deque()
+    try:
+        for id in id_list:
+            tasks.append(asyncio.ensure_future(fetch(id)))
+            if len(tasks) >= window:
+                alert = await tasks.popleft()
+                if alert is not None:
+                    yield alert
+        while tasks:
+            alert = await tasks.popleft()
+            if alert is not None:
+                yield alert
+    finally:
+        for task in tasks:
+            task.cancel()
+
+thehive_clients = {}
+thehive_clients_lock = threading.Lock()
+
+def thehive_api(config):
+
+    """
+    Return a TheHive client for `config`, built once and reused afterwards
+    :param config: TheHive config, `organisation` selects the TheHive 4
+        organisation of the alerts
+    :type config: dict
+    :return: TheHive client
+    :rtype: thehive4py.api.TheHiveApi
+    """
+
+    from thehive4py.api import TheHiveApi
+
+    key = (config.get('url', None), config.get('key'), config.get('organisation'), config.get('version', 3))
+    with thehive_clients_lock:
+        if key not in thehive_clients:
+            thehive_clients[key] = TheHiveApi(config.get('url', None), config.get('key'), config.get('password', None),
+                                              config.get('proxies'), organisation=config.get('organisation') or None,
+                                              version=config.get('version', 3))
+        return thehive_clients[key]
+
+def submit_alert(thapi, alert):
+
+    """
+    Create an alert in TheHive
+    :param thapi: TheHive client
+    :type thapi: thehive4py.api.TheHiveApi
+    :param alert: alert
+    :type alert: thehive4py.models Alert
+    :return: created, duplicate or failed
+    :rtype: str
+    """
+
+    from thehive4py.exceptions import AlertException
+
+    # files uploaded once the alert exists, see build_alert()
+    folder, attachments = alert.__dict__.pop('attachments', (None, None))
+    try:
+        with STAGE_SECONDS.time(stage='thehive_create'), tracer.span('create_alert', id=alert.sourceRef):
+            response = thapi.create_alert(alert)
+        # body of the request, as serialized by thehive4py
+        ALERT_BYTES.observe(len(response.request.body or b''))
+        if response.status_code in [200, 201] and attachments:
+            upload_attachments(thapi, response.json().get('id'), alert.sourceRef, attachments)
+    except AlertException as e:
+        logging.debug("submit_alert(): Error while creating alert for DS id #{}: {}".format(alert.sourceRef, e))
+        return "failed"
+    finally:
+        if folder is not None:
+            folder.release()
+
+    if response.status_code in [200, 201]:
+        return "created"
+    if response.status_code == 400 and ('ConflictError' in response.text or 'already exists' in response.text):
+        return "duplicate"
+    logging.debug("submit_alert(): Error while creating alert for DS id #{}: {} {}".format(alert.sourceRef,
+                                                                                           response.status_code, response.text))
+    return "failed"
+
+def upload_attachments(thapi, alert_id, source_ref, files):
+
+    """
+    Add files to an alert created in TheHive 4
+    :param thapi: TheHive client
+    :type thapi: thehive4py.api.TheHiveApi
+    :param alert_id: TheHive alert id
+    :type alert_id: str
+    :param source_ref: DS id, for logging
+    :type source_ref: str
+    :param files: paths
+    :type files: list
+    """
+
+    from thehive4py.exceptions import AlertArtifactException
+
+    for path in files:
+        artifact = image_artifact(path)
+        try:
+            response = thapi.create_alert_artifact(alert_id, artifact)
+            if response.status_code not in [200, 201]:
+                logging.debug("upload_attachments(): Error while adding {} to alert for DS id #{}: {} {}".format(
+                    os.path.basename(path), source_ref, response.status_code, response.text))
+        except AlertArtifactException as e:
+            logging.debug("upload_attachments(): Error while adding {} to alert for DS id #{}: {}".format(
+                os.path.basename(path), source_ref, e))
+        finally:
+            artifact.data['attachment'][1].close()
+
+def create_thehive_alerts(config, alerts, on_forwarded=None, progress=None):
     
     """
+    Send alerts to TheHive with `max_workers` threads. `alerts` is consumed
+    while earlier alerts are being created, so fetching DigitalShadows
+    incidents and creating alerts overlap.
     :param config: TheHive config
     :type config: dict
-    :param alerts: List of alerts
-    :type alerts: list
-    :return: create TH alert
+    :param alerts: alerts
+    :type alerts: iterable
+    :param on_forwarded: called with each alert created or already in TheHive
+    :type on_forwarded: function
+    :param progress: counts outcomes
+    :type progress: Progress
+    :return: number of alerts created, duplicate and failed
+    :rtype: dict
+    """
+
+    # the client is only made when there is an alert to create
+    thapi = None
+    workers = config.get('max_workers', 4)
+    outcomes = {'created': 0, 'duplicate': 0, 'failed': 0}
+    start = time.time()
+
+    submitted = {}
+
+    def collect(done):
+        for future in done:
+            alert = submitted.pop(future)
+            outcome = future.result()
+            outcomes[outcome] += 1
+            ALERTS.inc(outcome=outcome)
+            if progress is not None:
+                progress.add(outcome)
+            if outcome != "failed" and on_forwarded is not None:
+                on_forwarded(alert)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, tracer.span('create_thehive_alerts'):
+        for a in alerts:
+            if thapi is None:
+                thapi = thehive_api(config)
+            if config.get('templates').get(a.type):
+                a.caseTemplate = config.get('templates').get(a.type)
+            submitted[executor.submit(submit_alert, thapi, a)] = a
+            if len(submitted) >= 2 * workers:
+                # TheHive is slower than DigitalShadows
+                with tracer.span('thehive_backpressure'):
+                    collect(wait(submitted, return_when=FIRST_COMPLETED).done)
+        collect(wait(submitted).done)
+
+    elapsed = time.time() - start
+    total = sum(outcomes.values())
+    logging.debug("create_thehive_alerts(): {} created, {} duplicate, {} failed in {:.2f}s ({:.2f} alerts/s)".format(
+        outcomes['created'], outcomes['duplicate'], outcomes['failed'], elapsed, total / elapsed if elapsed else 0))
+    return outcomes
+
+def forwarded_index(config=DigitalShadows):
+
+    """
+    :param config: DigitalShadows config of the tenant
+    :type config: dict
+    :return: index of forwarded incidents if `index_file` is configured
+    :rtype: dsindex.ForwardedIndex
+    """
+
+    from dsindex import ForwardedIndex
+
+    if config.get('index_file'):
+        return ForwardedIndex(config.get('index_file'), config.get('index_retention', 30))
+    return None
+
+def poll(tenant, dsapi, inc_type, since, index=None, checkpoint=None):
+
+    """
+    Find DS incidents or intel-incidents and create the alerts in TheHive
+    :param tenant: DS account and TheHive organisation
+    :type tenant: tenants.Tenant
+    :param dsapi: DigitalShadows.api.DigitalShadowsApi of the tenant
+    :param inc_type: incident or intel-incident
+    :type inc_type: str
+    :param since: number of minutes
+    :type since: int
+    :type index: dsindex.ForwardedIndex
+    :type checkpoint: checkpoint.Checkpoint
+    :return: number of alerts created, duplicate and failed
+    :rtype: dict
+    """
+
+    start = time.perf_counter()
+    if inc_type == "intel-incident":
+        alerts = find_intel_incidents(dsapi, since, index, checkpoint, tenant.TheHive)
+    else:
+        alerts = find_incidents(dsapi, since, index, checkpoint, tenant.TheHive)
+
+    on_forwarded = None
+    if index is not None:
+        on_forwarded = functools.partial(index.commit, inc_type)
+
+    outcomes = create_thehive_alerts(tenant.TheHive, alerts, on_forwarded)
+    if checkpoint is not None and not outcomes['failed']:
+        checkpoint.save(inc_type)
+    POLL_SECONDS.observe(time.perf_counter() - start, tenant=tenant.name, type=inc_type)
+    LAST_POLL.set(time.time(), tenant=tenant.name, type=inc_type)
+    return outcomes
+
+def write_metrics():
+
+    """
+    Dump the metrics for the Prometheus textfile collector, if `metrics_file`
+    is set
     """
 
-    thapi = TheHiveApi(config.get('url', None), config.get('key'), config.get('password', None),
-                       config.get('proxies'))
-    for a in alerts:
-        if config.get('templates').get(a.type):
-            a.caseTemplate = config.get('templates').get(a.type)
-        thapi.create_alert(a)
+    path = DigitalShadows.get('metrics_file')
+    if not path:
+        return
+    try:
+        metrics.write_textfile(path)
+    except OSError as e:
+        logging.error("write_metrics(): Error while writing {}: {}".format(path, e))
 
 def run():
     
@@ -445,28 +1142,151 @@ def run():
         logging.debug("Error while importing config, check config.py file in config folder: \n{}".format(e))
         sys.exit("Error while importing config, check config.py file in config/ folder or debug logs")
 
+    def each_tenant(func):
+
+        """
+        Call func(tenant, dsapi) for each tenant, `tenant_workers` at a time
+        """
+
+        if len(clients) == 1:
+            func(*clients[0])
+            return
+        with ThreadPoolExecutor(max_workers=min(DigitalShadows.get('tenant_workers', 4), len(clients)),
+                                thread_name_prefix='tenant') as executor:
+            futures = [(tenant, executor.submit(func, tenant, dsapi)) for tenant, dsapi in clients]
+        failed = []
+        for tenant, future in futures:
+            e = future.exception()
+            if e is not None:
+                logging.error("run(): tenant {} failed: {}".format(tenant, e))
+                failed.append(str(tenant))
+        if failed:
+            sys.exit("Error for tenants {}, check debug logs".format(", ".join(failed)))
+
     def find(args):
         if 'last' in args and args.last is not None:
             last = args.last.pop()
-            
-        if (not args.i ^ args.I) or args.I:
-            intel = find_intel_incidents(dsapi, last)
-            create_thehive_alerts(TheHive, intel)
-        if (not args.i ^ args.I) or args.i:
-            incidents = find_incidents(dsapi, last)
-            create_thehive_alerts(TheHive, incidents)
-        if args.monitor:
-            mon = monitoring(monitoringfile)
-            mon.touch()
+
+        def find_tenant(tenant, dsapi):
+            index = forwarded_index(tenant.DigitalShadows)
+            checkpoint = None
+            if args.checkpoint:
+                checkpoint = Checkpoint(tenant.DigitalShadows.get('checkpoint_file', 'log/ds2th.checkpoint'))
+
+            if (not args.i ^ args.I) or args.I:
+                poll(tenant, dsapi, "intel-incident", last, index, checkpoint)
+            if (not args.i ^ args.I) or args.i:
+                poll(tenant, dsapi, "incident", last, index, checkpoint)
+            if index is not None:
+                index.close()
+            if args.monitor:
+                mon = monitoring(tenant.DigitalShadows.get('monitoring_file'))
+                mon.touch()
+
+        each_tenant(find_tenant)
  
+    def bulk(tenant, dsapi, inc_type, get, file, index, force):
+        ids = read_ids(file)
+        progress = Progress(inc_type, len(ids))
+        create_thehive_alerts(tenant.TheHive, get(dsapi, ids, index, force, progress, tenant.TheHive),
+                              index and functools.partial(index.commit, inc_type), progress)
+        progress.done()
+
     def inc(args):
+        # IDs are those of a single tenant, see -t
+        tenant, dsapi = clients[0]
+        index = forwarded_index(tenant.DigitalShadows)
         if 'intel_incidents' in args and args.intel_incidents is not None:
-            intel_incidents = get_intel_incidents(dsapi, args.intel_incidents)
-            create_thehive_alerts(TheHive, intel_incidents)
+            intel_incidents = get_intel_incidents(dsapi, args.intel_incidents, index, args.force, thehive=tenant.TheHive)
+            create_thehive_alerts(tenant.TheHive, intel_incidents,
+                                  index and functools.partial(index.commit, "intel-incident"))
+        if args.intel_incidents_file is not None:
+            bulk(tenant, dsapi, "intel-incident", get_intel_incidents, args.intel_incidents_file, index, args.force)
 
         if 'incidents' in args and args.incidents is not None:
-            incidents = get_incidents(dsapi, args.incidents)
-            create_thehive_alerts(TheHive, incidents)
+            incidents = get_incidents(dsapi, args.incidents, index, args.force, thehive=tenant.TheHive)
+            create_thehive_alerts(tenant.TheHive, incidents, index and functools.partial(index.commit, "incident"))
+        if args.incidents_file is not None:
+            bulk(tenant, dsapi, "incident", get_incidents, args.incidents_file, index, args.force)
+        if index is not None:
+            index.close()
+
+    def daemon(args):
+        # index and checkpoint of each tenant
+        states = [(tenant, dsapi, forwarded_index(tenant.DigitalShadows),
+                   Checkpoint(tenant.DigitalShadows.get('checkpoint_file', 'log/ds2th.checkpoint')))
+                  for tenant, dsapi in clients]
+        intervals = {}
+        for t, (tenant, dsapi, index, checkpoint) in enumerate(states):
+            if (not args.i ^ args.I) or args.I:
+                intervals[(t, "intel-incident")] = tenant.DigitalShadows.get('intel_incidents_interval', 60)
+            if (not args.i ^ args.I) or args.i:
+                intervals[(t, "incident")] = tenant.DigitalShadows.get('incidents_interval', 60)
+        for (t, inc_type), interval in intervals.items():
+            POLL_INTERVAL.set(interval, tenant=states[t][0].name, type=inc_type)
+        # the indexes are opened once, their old entries are evicted daily
+        evicted = {t: time.time() for t in range(len(states))}
+        metrics_server = None
+        if DigitalShadows.get('metrics_port'):
+            metrics_server = metrics.serve(DigitalShadows.get('metrics_address', '127.0.0.1'),
+                                           DigitalShadows.get('metrics_port'))
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+        def cycle(t, inc_type):
+            tenant, dsapi, index, checkpoint = states[t]
+            try:
+                if index is not None and time.time() - evicted[t] >= 86400:
+                    evicted[t] = time.time()
+                    index.evict(tenant.DigitalShadows.get('index_retention', 30))
+                outcomes = poll(tenant, dsapi, inc_type, args.last, index, checkpoint)
+                logging.debug("daemon(): {} {} poll done: {}".format(tenant, inc_type, outcomes))
+                if args.monitor:
+                    monitoring(tenant.DigitalShadows.get('monitoring_file')).touch()
+            except (Exception, SystemExit) as e:
+                logging.error("daemon(): {} {} poll failed: {}".format(tenant, inc_type, e))
+                POLL_FAILURES.inc(tenant=tenant.name, type=inc_type)
+            write_metrics()
+
+        # the polls of the tenants run `tenant_workers` at a time, the one due
+        # for the longest first, and one at a time per tenant since its index
+        # and checkpoint are not shared between threads
+        workers = min(DigitalShadows.get('tenant_workers', 4), len(states))
+        next_poll = {key: time.time() for key in intervals}
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tenant') as executor:
+            while not stop.is_set():
+                now = time.time()
+                busy = set(t for t, inc_type in running.values())
+                idle = [key for key in next_poll if key[0] not in busy]
+                due = [key for key in idle if next_poll[key] <= now]
+                if due and len(running) < workers:
+                    key = min(due, key=next_poll.get)
+                    running[executor.submit(cycle, *key)] = key
+                    continue
+                delay = None
+                if idle and len(running) < workers:
+                    delay = min(next_poll[key] for key in idle) - now
+                if not running:
+                    stop.wait(delay)
+                    continue
+                # check `stop` at least every second
+                done = wait(running, timeout=min(delay, 1) if delay is not None else 1,
+                            return_when=FIRST_COMPLETED).done
+                for future in done:
+                    t, inc_type = key = running.pop(future)
+                    jitter = states[t][0].DigitalShadows.get('poll_jitter', 5)
+                    next_poll[key] = time.time() + intervals[key] + random.uniform(0, jitter)
+            logging.debug("daemon(): stopping, waiting for {} polls".format(len(running)))
+
+        logging.debug("daemon(): stopped")
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        for tenant, dsapi, index, checkpoint in states:
+            if index is not None:
+                index.close()
 
     parser = argparse.ArgumentParser(
         description="Get DS incidents and intel-incidents and create alerts in TheHive")
@@ -474,6 +1294,22 @@ def run():
                         action='store_true',
                         default=False,
                         help="generate a log file and active debug logging")
+    parser.add_argument("-a", "--asyncio",
+                        action='store_true',
+                        default=False,
+                        help="fetch DS incidents from an asyncio event loop\
+                         (requires aiohttp)")
+    parser.add_argument("-p", "--profile",
+                        action='store_true',
+                        default=False,
+                        help="write the time spent on each incident to the\
+                         profile_file trace (chrome://tracing)")
+    parser.add_argument("-t", "--tenant",
+                        metavar="NAME",
+                        action='append',
+                        default=[],
+                        help="only use the tenant NAME of `tenants` in\
+                         config.py, may be repeated (default: all tenants)")
     subparsers = parser.add_subparsers(help="subcommand help")
     
     parser_incident = subparsers.add_parser('inc',
@@ -490,6 +1326,21 @@ def run():
                                  action='store',
                                  type=int, nargs='+',
                                  help="Get DS intel-incidents by ID")
+    parser_incident.add_argument("--incidents-file",
+                                 metavar="FILE",
+                                 type=argparse.FileType('r'),
+                                 help="Get DS incidents by ID, read from FILE\
+                                  (- for stdin), with progress on stderr")
+    parser_incident.add_argument("--intel-incidents-file",
+                                 metavar="FILE",
+                                 type=argparse.FileType('r'),
+                                 help="Get DS intel-incidents by ID, read from\
+                                  FILE (- for stdin), with progress on stderr")
+    parser_incident.add_argument("-f", "--force",
+                                 action='store_true',
+                                 default=False,
+                                 help="Create alerts of incidents already\
+                                  forwarded and not modified since")
     parser_incident.set_defaults(func=inc)
 
     parser_find = subparsers.add_parser('find',
@@ -501,6 +1352,11 @@ def run():
                              type=int,required=True,
                              help="Get all incidents published during\
                               the last [M] minutes")
+    parser_find.add_argument("-c", "--checkpoint",
+                             action='store_true',
+                             default=False,
+                             help="Get incidents published since the last\
+                              run, [M] minutes is only used for the first one")
     parser_find.add_argument("-m", "--monitor",
                              action='store_true',
                              default=False,
@@ -515,6 +1371,29 @@ def run():
                              help="Get Digital Shadows intel-incidents only")
     parser_find.set_defaults(func=find)
 
+    parser_daemon = subparsers.add_parser('daemon',
+                                          help="poll incidents and \
+                                          intel-incidents continuously")
+    parser_daemon.add_argument("-l", "--last",
+                               metavar="M",
+                               type=int,
+                               default=60,
+                               help="Get incidents published during the last\
+                                [M] minutes on the first poll (default: 60)")
+    parser_daemon.add_argument("-m", "--monitor",
+                               action='store_true',
+                               default=False,
+                               help="active monitoring")
+    parser_daemon.add_argument("-i",
+                               action='store_true',
+                               default=False,
+                               help="Get Digital Shadows incidents only")
+    parser_daemon.add_argument("-I",
+                               action='store_true',
+                               default=False,
+                               help="Get Digital Shadows intel-incidents only")
+    parser_daemon.set_defaults(func=daemon)
+
     if len(sys.argv[1:]) == 0:
         parser.print_help()
         parser.exit()
@@ -524,8 +1403,46 @@ def run():
         logging.basicConfig(filename=logfile,
                             level='DEBUG',
                             format='%(asctime)s %(levelname)s %(message)s')
-    dsapi = DigitalShadowsApi(DigitalShadows)
-    args.func(args)
+    try:
+        tenants = load_tenants(DigitalShadows, TheHive)
+    except ValueError as e:
+        sys.exit("Error in tenants of config.py: {}".format(e))
+    try:
+        tenants = select_tenants(tenants, args.tenant)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.func is inc and len(tenants) > 1:
+        parser.error("inc: IDs are those of a single tenant, select it with -t")
+
+    if args.asyncio:
+        from DigitalShadows.aioapi import AsyncDigitalShadowsApi as DigitalShadowsApi
+    else:
+        from DigitalShadows.api import DigitalShadowsApi
+    # the clients of the other tenants share the pooled connections of the
+    # first one, each with its own credentials and rate limit
+    dsapi = DigitalShadowsApi(tenants[0].DigitalShadows)
+    clients = [(tenants[0], dsapi)] + [(tenant, DigitalShadowsApi(tenant.DigitalShadows, dsapi))
+                                       for tenant in tenants[1:]]
+    if args.profile:
+        tracer.enable()
+    try:
+        args.func(args)
+    finally:
+        # folders left by alerts which were not submitted
+        artifact_store.close()
+        write_metrics()
+        if args.profile:
+            tracer.write(DigitalShadows.get('profile_file', 'log/ds2th.trace.json'))
+    logging.debug("run(): DigitalShadows connections: {}".format(dsapi.connection_stats()))
+    for tenant, client in clients:
+        if client.cache is not None:
+            logging.debug("run(): DigitalShadows responses of {}: {}".format(tenant, client.cache.stats()))
+    logging.debug("run(): thumbnail cache: {}".format(thumbnail_cache.stats()))
+    logging.debug("run(): thumbnail sizes: {}".format(thumbnail_shrinker.stats()))
+    logging.debug("run(): artifact files: {}".format(artifact_store.stats()))
+    # dsapi, owning the pooled connections, last
+    for tenant, client in reversed(clients):
+        client.close()
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import time
+import logging
+
+
+class ForwardedIndex():
+
+    def __init__(self, path, retention=30):
+
+        """
+        Local index of DigitalShadows incidents already forwarded to TheHive
+        :param path: sqlite database file
+        :type path: str
+        :param retention: number of days an entry is kept
+        :type retention: int
+        """
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.pending = {}
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS forwarded ("
+                            "type TEXT NOT NULL, "
+                            "id TEXT NOT NULL, "
+                            "modified TEXT NOT NULL, "
+                            "forwarded REAL NOT NULL, "
+                            "PRIMARY KEY (type, id, modified))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS forwarded_date ON forwarded (forwarded)")
+        self.evict(retention)
+
+    def evict(self, retention):
+
+        """
+        Remove entries forwarded more than `retention` days ago
+        :type retention: int
+        """
+
+        with self.lock, self.db:
+            deleted = self.db.execute("DELETE FROM forwarded WHERE forwarded < ?",
+                                      (time.time() - retention * 86400,)).rowcount
+        logging.debug("ForwardedIndex.evict(): {} entries older than {} days removed".format(deleted, retention))
+
+    def seen(self, type, id, modified):
+
+        """
+        :param type: incident or intel-incident
+        :type type: str
+        :type id: int
+        :type modified: str
+        :return: True if this version of the incident has already been forwarded
+        :rtype: bool
+        """
+
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM forwarded WHERE type = ? AND id = ? AND modified = ?",
+                                  (type, str(id), str(modified))).fetchone()
+        return row is not None
+
+    def filter(self, type, incidents, force=False):
+
+        """
+        Skip incidents already forwarded, remember the others until commit()
+        :param type: incident or intel-incident
+        :type type: str
+        :param incidents: DS incidents
+        :type incidents: iterable
+        :param force: keep incidents already forwarded too
+        :type force: bool
+        :return: DS incidents not forwarded yet
+        :rtype: generator
+        """
+
+        skipped = 0
+        for incident in incidents:
+            id = str(incident.get('id'))
+            modified = str(incident.get('modified'))
+            if not force and self.seen(type, id, modified):
+                skipped += 1
+                continue
+            with self.lock:
+                self.pending[(type, id)] = modified
+            yield incident
+        logging.debug("ForwardedIndex.filter(): {} {}(s) already forwarded skipped".format(skipped, type))
+
+    def commit(self, type, alert):
+
+        """
+        Record an alert as forwarded
+        :param type: incident or intel-incident
+        :type type: str
+        :param alert: alert created in TheHive
+        :type alert: thehive4py.models Alert
+        """
+
+        with self.lock:
+            modified = self.pending.pop((type, alert.sourceRef), None)
+            if modified is None:
+                return
+            with self.db:
+                self.db.execute("INSERT OR REPLACE INTO forwarded (type, id, modified, forwarded) VALUES (?, ?, ?, ?)",
+                                (type, alert.sourceRef, modified, time.time()))
+
+    def close(self):
+        self.db.close()
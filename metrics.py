@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 100 * 1024 * 1024)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric():
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+
+        """
+        Metric in the Prometheus text format, added to the registry
+        :param name: metric name
+        :type name: str
+        :param help: description
+        :type help: str
+        :param labels: label names, given as keyword arguments when updating
+        :type labels: tuple
+        """
+
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(l, '')) for l in self.labels)
+
+    def selector(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(k, escape(v)) for k, v in pairs) + "}"
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + self.selector(key), value) for key, value in sorted(self.values.items())]
+
+    def exposition(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+        lines.extend("{} {}".format(sample, number(value)) for sample, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+
+        """
+        Observe the duration of the block, in seconds
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((self.name + "_bucket" + self.selector(key, [('le', number(bound))]), count))
+                samples.append((self.name + "_sum" + self.selector(key), counts[-1]))
+                samples.append((self.name + "_count" + self.selector(key), counts[-2]))
+        return samples
+
+
+def timed(histogram, iterable, **labels):
+
+    """
+    Observe the time taken by each item of `iterable`, i.e. each page of a
+    DigitalShadows search
+    :type histogram: Histogram
+    :type iterable: iterable
+    :rtype: generator
+    """
+
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        histogram.observe(time.perf_counter() - start, **labels)
+        yield item
+
+async def async_timed(histogram, iterable, **labels):
+
+    """
+    timed() for async iterables
+    :rtype: async generator
+    """
+
+    iterator = iterable.__aiter__()
+    while True:
+        start = time.perf_counter()
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        histogram.observe(time.perf_counter() - start, **labels)
+        yield item
+
+def exposition():
+
+    """
+    :return: all the metrics in the Prometheus text format
+    :rtype: str
+    """
+
+    return "\n".join(metric.exposition() for metric in registry) + "\n"
+
+def write_textfile(path):
+
+    """
+    Write the metrics for the textfile collector of the Prometheus node
+    exporter, atomically
+    :param path: file name, ending with .prom
+    :type path: str
+    """
+
+    tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp, 'w') as f:
+        f.write(exposition())
+    os.replace(tmp, path)
+
+
+def serve(address, port):
+
+    """
+    Expose the metrics on http://address:port/metrics from a daemon thread
+    :return: the server, to shutdown()
+    :rtype: http.server.ThreadingHTTPServer
+    """
+
+    # only the daemon serves metrics, http.server is not imported otherwise
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ['/', '/metrics']:
+                self.send_error(404)
+                return
+            body = exposition().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug("MetricsHandler: " + format % args)
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.debug("serve(): metrics exposed on http://{}:{}/metrics".format(address, server.server_port))
+    return server
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+import itertools
+import ipaddress
+import logging
+from urllib.parse import urlsplit, urlunsplit
+
+from thehive4py.models import AlertArtifact
+
+from ds2markdown import databreach_message
+from artifacts import QuotaExceeded
+
+# DigitalShadows IOC type -> TheHive dataType
+DATATYPES = {
+    'IP': 'ip',
+    'HOST': 'domain',
+    'URL': 'url',
+    'SHA256': 'hash',
+    'SHA1': 'hash',
+    'MD5': 'hash',
+    'FILENAME': 'filename',
+    'FILEPATH': 'filename',
+    'EMAIL': 'mail'
+}
+
+EMAIL = re.compile(r"^[A-Za-z0-9\.\+\-\_]+\@[\w\d\-\_\.]+\.[a-zA-Z]{2,3}$")
+
+IOC_TAGS = ["src:DigitalShadows"]
+DATABREACH_TAGS = ["src:DigitalShadows", "databreach"]
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+
+def canonical_ip(data):
+    if ':' not in data:
+        # an IPv4 address is valid only in its canonical form, leading
+        # zeros are refused
+        return data
+    try:
+        return str(ipaddress.ip_address(data))
+    except ValueError:
+        return data
+
+def canonical_domain(data):
+    return data.lower().rstrip('.')
+
+def canonical_url(data):
+
+    """
+    Lowercase scheme and host, drop the default port and an empty path
+    """
+
+    try:
+        url = urlsplit(data)
+        port = url.port
+    except ValueError:
+        return data
+    if not url.scheme or not url.hostname:
+        return data
+    netloc = url.hostname.rstrip('.')
+    if ':' in netloc:
+        # IPv6 address, without its brackets in `hostname`
+        netloc = "[{}]".format(netloc)
+    if url.username is not None or url.password is not None:
+        netloc = "{}@{}".format(url.netloc.rpartition('@')[0], netloc)
+    if port is not None and port != DEFAULT_PORTS.get(url.scheme.lower()):
+        netloc = "{}:{}".format(netloc, port)
+    return urlunsplit((url.scheme.lower(), netloc, url.path if url.path != '/' else '', url.query, url.fragment))
+
+# TheHive dataType -> canonical form of its values
+CANONICAL = {
+    'ip': canonical_ip,
+    'domain': canonical_domain,
+    'fqdn': canonical_domain,
+    'url': canonical_url,
+    'hash': str.lower,
+    'mail': str.lower
+}
+
+
+def canonical(dataType, data):
+
+    """
+    :param dataType: TheHive dataType
+    :type dataType: str
+    :param data: observable value
+    :type data: str
+    :return: canonical form of the value, used to find duplicates
+    :rtype: str
+    """
+
+    if not isinstance(data, str):
+        return data
+    data = data.strip()
+    canonicalize = CANONICAL.get(dataType)
+    if canonicalize is not None:
+        return canonicalize(data)
+    return data
+
+
+class ObservableSet():
+
+    def __init__(self, max_details=None):
+
+        """
+        Observables of an alert indexed by dataType and canonical value:
+        duplicates are merged into one observable with their details
+        (sources, databreach records). The value sent to TheHive is the first
+        one seen, the canonical value is only used to find duplicates.
+        :param max_details: details kept per observable, the next ones are
+            only counted (None means no limit)
+        :type max_details: int
+        """
+
+        self.index = {}
+        self.max_details = max_details
+        self.omitted = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, dataType, data, detail):
+
+        """
+        :param dataType: TheHive dataType
+        :type dataType: str
+        :param data: observable value
+        :type data: str
+        :param detail: i.e. source of the observable, kept once per observable
+        :type detail: str
+        :return: True if the observable is new
+        :rtype: bool
+        """
+
+        # values mostly come in their canonical form: a duplicate repeated as
+        # is is found without computing it
+        key = (dataType, data)
+        entry = self.index.get(key)
+        if entry is None:
+            value = canonical(dataType, data)
+            if value != data:
+                key = (dataType, value)
+                entry = self.index.get(key)
+            if entry is None:
+                self.index[key] = (data, {detail: None})
+                return True
+        details = entry[1]
+        if detail not in details:
+            if self.max_details is not None and len(details) >= self.max_details:
+                self.omitted[key] = self.omitted.get(key, 0) + 1
+            else:
+                details[detail] = None
+        return False
+
+    def artifacts(self, message, tags):
+
+        """
+        :param message: builds the message of an observable from its details
+        :type message: function
+        :param tags: tags of the observables
+        :type tags: list
+        :return: AlertArtifact
+        :rtype: thehive4py.models AlertArtifact
+        """
+
+        return [AlertArtifact(data=data,
+                              dataType=key[0],
+                              message=self.message(message, key, details),
+                              tlp=2,
+                              tags=list(tags))
+                for key, (data, details) in self.index.items()]
+
+    def message(self, message, key, details):
+        text = message(list(details))
+        omitted = self.omitted.get(key)
+        if omitted:
+            text += "\n\n({} more not shown)".format(omitted)
+        return text
+
+
+def th_dataType(type):
+
+    """
+    convert DigitalShadows IOC type to TH dataType
+    :param type: DS type
+    :type type: str
+    :return: TH dataType
+    :rtype: str
+    """
+
+    return DATATYPES.get(type, "other")
+
+def build_observables(observables):
+
+    """
+    Convert DS observables into TheHive observables, in a single pass
+    merging duplicates and their sources
+    :param observables: observables from DS
+    :type observables: dict
+    :return: AlertArtifact
+    :rtype: thehive4py.models AlertArtifact
+    """
+
+    found = ObservableSet()
+    if observables.get('total', 0) > 0:
+        for ioc in observables.get('content'):
+            found.add(DATATYPES.get(ioc.get('type'), "other"), ioc.get('value'), ioc.get('source'))
+
+    return found.artifacts(ioc_message, IOC_TAGS)
+
+def ioc_message(sources):
+    return "Observable from DigitalShadows. Source: {}".format(", ".join(str(s) for s in sources))
+
+def databreach_records_message(messages):
+    return "\n\n----\n\n".join(messages)
+
+def databreach_csv_columns(record):
+    """
+    Return the columns of the csv file, i.e. the str fields of a databreach record
+    :param record: databreach record
+    :type record: dict
+    :return: column names
+    :rtype: list
+    """
+    return [k for k, v in record.items() if type(v) is str]
+
+def databreach_csv_row(columns, record):
+    """
+    Return str content of a csv line for a databreach record
+    :param columns: column names
+    :type columns: list
+    :param record: databreach record
+    :type record: dict
+    :return: csv line
+    :rtype: str
+    """
+    get = record.get
+    return ";".join([str(get(c, '')) for c in columns]) + ";"
+
+def build_observables_from_databreach(records, folder, max_observables=1000, max_merged=10):
+    """
+    Convert DS databreach records into TheHive observables, in a single
+    pass: records are written to the csv file as they come, only the first
+    `max_observables` distinct usernames are also added as observables,
+    with up to `max_merged` records of the same username merged in the
+    message, the others being counted. The csv file is truncated when the
+    artifact quota is reached.
+    :param records: databreach records from DS
+    :type records: iterable
+    :param folder: folder where the csv file is written
+    :type folder: artifacts.ArtifactFolder
+    :param max_observables: max number of observables
+    :type max_observables: int
+    :param max_merged: max number of records in the message of an observable
+    :type max_merged: int
+    :return: AlertArtifact
+    :rtype: thehive4py.models AlertArtifact
+    """
+
+    artefacts = []
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        return artefacts
+
+    columns = databreach_csv_columns(first)
+    found = ObservableSet(max_merged)
+    count = 0
+    truncated = False
+
+    with folder.open('leak.csv') as leakfd:
+        write = leakfd.write
+        try:
+            write("".join("{};".format(c) for c in columns))
+        except QuotaExceeded:
+            truncated = True
+        for ioc in itertools.chain([first], records):
+            if not truncated:
+                try:
+                    write("\n" + databreach_csv_row(columns, ioc))
+                    count += 1
+                except QuotaExceeded as e:
+                    logging.debug("build_observables_from_databreach(): {}, {} records written".format(e, count))
+                    truncated = True
+            if len(found) >= max_observables:
+                if truncated:
+                    break
+                continue
+            username = ioc.get('username')
+            found.add("mail" if EMAIL.match(username or "") else "other", username, databreach_message(ioc))
+
+    artefacts = found.artifacts(databreach_records_message, DATABREACH_TAGS)
+    if count > len(artefacts):
+        logging.debug("build_observables_from_databreach(): {} records, {} added as observables".format(count, len(artefacts)))
+
+    artefacts.append(AlertArtifact(dataType="file",
+                                   data=leakfd.name,
+                                   message="List of records from DigitalShadows{}".format(
+                                       " (truncated)" if truncated else ""),
+                                   tlp=2,
+                                   tags=list(DATABREACH_TAGS))
+                     )
+
+    return artefacts
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+
+# files of a tenant, named after the tenant unless set in its config
+TENANT_FILES = ['index_file', 'checkpoint_file', 'response_cache_file', 'monitoring_file']
+
+NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+class Tenant():
+
+    def __init__(self, name, digitalshadows, thehive):
+
+        """
+        DigitalShadows account and the TheHive organisation its alerts are
+        created in
+        :param name: tenant name, '' without `tenants` in config.py
+        :type name: str
+        :param digitalshadows: DigitalShadows config of the account
+        :type digitalshadows: dict
+        :param thehive: TheHive config of the organisation
+        :type thehive: dict
+        """
+
+        self.name = name
+        self.DigitalShadows = digitalshadows
+        self.TheHive = thehive
+
+    def __str__(self):
+        return self.name or "default"
+
+
+def tenant_file(path, name):
+
+    """
+    :param path: i.e. log/ds2th.db
+    :type path: str
+    :param name: tenant name
+    :type name: str
+    :return: file of the tenant, i.e. log/ds2th.subsidiary.db
+    :rtype: str
+    """
+
+    if not path or not name:
+        return path
+    root, ext = os.path.splitext(path)
+    return "{}.{}{}".format(root, name, ext)
+
+def load_tenants(digitalshadows, thehive):
+
+    """
+    Tenants of the `tenants` list of the DigitalShadows config. Each one
+    overrides the DigitalShadows settings with its own keys (ds_key,
+    ds_secret, rate_limit...) and the TheHive settings with its `TheHive`
+    dict (key, organisation...). Without `tenants`, the config is the only
+    tenant.
+    :param digitalshadows: DigitalShadows config
+    :type digitalshadows: dict
+    :param thehive: TheHive config
+    :type thehive: dict
+    :return: tenants
+    :rtype: list
+    """
+
+    configs = digitalshadows.get('tenants') or []
+    if not configs:
+        return [Tenant('', digitalshadows, thehive)]
+
+    tenants = []
+    for config in configs:
+        name = config.get('name', '')
+        if not NAME.match(name):
+            raise ValueError("tenant {!r}: name must be made of letters, digits, '_', '.' or '-'".format(name))
+        if name in [t.name for t in tenants]:
+            raise ValueError("tenant {!r}: duplicate name".format(name))
+        ds = {k: v for k, v in digitalshadows.items() if k != 'tenants'}
+        for key in TENANT_FILES:
+            ds[key] = tenant_file(ds.get(key), name)
+        ds.update((k, v) for k, v in config.items() if k not in ['name', 'TheHive'])
+        tenants.append(Tenant(name, ds, dict(thehive, **config.get('TheHive', {}))))
+    return tenants
+
+def select_tenants(tenants, names):
+
+    """
+    :param tenants: configured tenants
+    :type tenants: list
+    :param names: tenant names, all tenants if empty
+    :type names: list
+    :return: tenants named in `names`
+    :rtype: list
+    """
+
+    if not names:
+        return tenants
+    unknown = set(names) - set(t.name for t in tenants)
+    if unknown:
+        raise ValueError("unknown tenant: {}".format(", ".join(sorted(unknown))))
+    return [t for t in tenants if t.name in names]
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+import logging
+from io import BytesIO
+from collections import OrderedDict
+
+
+def pillow():
+
+    """
+    Pillow is slow to import, so it is only imported when thumbnails are resized
+    :return: PIL.Image, None if Pillow is not installed
+    """
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+class ThumbnailCache():
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, directory=None, max_disk_bytes=256 * 1024 * 1024):
+
+        """
+        Cache of thumbnails ready to be added in markdown (data URI strings),
+        keyed by DigitalShadows screenshotThumbnailId. Least recently used
+        thumbnails are evicted once `max_bytes` are held in memory, and once
+        `max_disk_bytes` are stored in `directory` if set.
+        :type max_bytes: int
+        :param directory: folder where thumbnails are also stored
+        :type directory: str
+        :type max_disk_bytes: int
+        """
+
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        # files of `directory` in LRU order with their size, see disk_files()
+        self.files = None
+        self.disk_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, thumbnail_id):
+        return os.path.join(self.directory, "{}.uri".format(re.sub(r'[^\w\-]', '_', str(thumbnail_id))))
+
+    def get(self, thumbnail_id):
+
+        """
+        :type thumbnail_id: str
+        :return: data URI, None if not in cache
+        :rtype: str
+        """
+
+        with self.lock:
+            thumbnail = self.entries.get(thumbnail_id)
+            if thumbnail is not None:
+                self.entries.move_to_end(thumbnail_id)
+                self.hits += 1
+                return thumbnail
+
+        if self.directory:
+            path = self.path(thumbnail_id)
+            try:
+                with open(path) as f:
+                    thumbnail = f.read()
+                # the mtime keeps the LRU order for the next runs
+                os.utime(path, None)
+            except FileNotFoundError:
+                pass
+            if thumbnail is not None:
+                with self.lock:
+                    files = self.disk_files()
+                    if path in files:
+                        files.move_to_end(path)
+                self.put(thumbnail_id, thumbnail, store=False)
+                with self.lock:
+                    self.hits += 1
+                return thumbnail
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, thumbnail_id, thumbnail, store=True):
+
+        """
+        :type thumbnail_id: str
+        :param thumbnail: data URI
+        :type thumbnail: str
+        :param store: also write it in `directory`
+        :type store: bool
+        """
+
+        size = len(thumbnail)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if thumbnail_id in self.entries:
+                self.size -= len(self.entries.pop(thumbnail_id))
+            self.entries[thumbnail_id] = thumbnail
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+        if self.directory and store and size <= self.max_disk_bytes:
+            tmp = "{}.{}.tmp".format(self.path(thumbnail_id), threading.get_ident())
+            with open(tmp, 'w') as f:
+                f.write(thumbnail)
+            os.replace(tmp, self.path(thumbnail_id))
+            # data URIs are ASCII: one byte per character
+            self.stored(self.path(thumbnail_id), size)
+
+    def disk_files(self):
+
+        """
+        Scan `directory` on first use, the files written afterwards are
+        tracked by stored(). Must be called with the lock held.
+        :return: paths of the files in LRU order, and their size
+        :rtype: OrderedDict
+        """
+
+        if self.files is None:
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.uri'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.path, stat.st_size))
+            self.files = OrderedDict((path, size) for _, path, size in sorted(files))
+            self.disk_size = sum(self.files.values())
+        return self.files
+
+    def stored(self, path, size):
+
+        """
+        Track a file written to `directory` and remove the least recently
+        used ones once `max_disk_bytes` are stored
+        """
+
+        with self.lock:
+            files = self.disk_files()
+            self.disk_size += size - files.pop(path, 0)
+            files[path] = size
+            while self.disk_size > self.max_disk_bytes and len(files) > 1:
+                evicted, evicted_size = files.popitem(last=False)
+                self.disk_size -= evicted_size
+                try:
+                    os.remove(evicted)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+
+        """
+        :return: cache hits, misses and bytes held in memory
+        :rtype: dict
+        """
+
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries), 'bytes': self.size}
+
+
+class ThumbnailShrinker():
+
+    def __init__(self, max_dimension=0, format='JPEG', quality=75, max_bytes=0):
+
+        """
+        Downscale and recompress thumbnails before they are embedded in alert
+        descriptions. Resizing needs Pillow; without it only the `max_bytes`
+        ceiling is enforced.
+        :param max_dimension: max width and height in pixels, 0 to keep the size
+        :type max_dimension: int
+        :param format: Pillow format of resized thumbnails
+        :type format: str
+        :param quality: quality of resized thumbnails
+        :type quality: int
+        :param max_bytes: thumbnails still bigger than this are dropped, 0 for no limit
+        :type max_bytes: int
+        """
+
+        self.max_dimension = max_dimension
+        self.format = format
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.image = pillow() if self.max_dimension else None
+        if self.max_dimension and self.image is None:
+            logging.debug("ThumbnailShrinker(): Pillow is not installed, thumbnails are not resized")
+
+    def encode(self, image, quality):
+        with BytesIO() as output:
+            image.save(output, format=self.format, quality=quality, optimize=True)
+            return output.getvalue()
+
+    def shrink(self, content, content_type):
+
+        """
+        :param content: image
+        :type content: bytes
+        :param content_type: mime type of the image
+        :type content_type: str
+        :return: image and mime type, (None, None) if it can't fit in `max_bytes`
+        :rtype: tuple
+        """
+
+        original = len(content)
+        if self.max_dimension and self.image is not None:
+            try:
+                with self.image.open(BytesIO(content)) as image:
+                    image.thumbnail((self.max_dimension, self.max_dimension))
+                    if self.format.upper() == 'JPEG' and image.mode not in ['RGB', 'L']:
+                        image = image.convert('RGB')
+                    quality = self.quality
+                    resized = self.encode(image, quality)
+                    # lower the quality until the thumbnail fits the ceiling
+                    while self.max_bytes and len(resized) > self.max_bytes and quality > 20:
+                        quality -= 15
+                        resized = self.encode(image, quality)
+                if len(resized) < len(content):
+                    content = resized
+                    content_type = self.image.MIME.get(self.format.upper(), content_type)
+            except (OSError, ValueError, KeyError) as e:
+                logging.debug("ThumbnailShrinker.shrink(): thumbnail not resized: {}".format(e))
+
+        with self.lock:
+            self.bytes_in += original
+            if self.max_bytes and len(content) > self.max_bytes:
+                self.dropped += 1
+                return None, None
+            self.bytes_out += len(content)
+        return content, content_type
+
+    def stats(self):
+
+        """
+        :return: bytes downloaded, bytes kept, bytes saved and thumbnails dropped
+        :rtype: dict
+        """
+
+        with self.lock:
+            return {'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+                    'saved': self.bytes_in - self.bytes_out, 'dropped': self.dropped}
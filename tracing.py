@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import sys
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+
+class Tracer():
+
+    def __init__(self, max_events=1000000):
+
+        """
+        Timing spans written as a Chrome trace, to be opened in
+        chrome://tracing or https://ui.perfetto.dev. Spans are only recorded
+        once enable() has been called, see ds2th.py --profile.
+        Each thread, and each asyncio task, gets its own track.
+        :param max_events: spans recorded at most, the next ones are dropped
+        :type max_events: int
+        """
+
+        self.events = None
+        self.max_events = max_events
+        self.dropped = 0
+        self.tracks = set()
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    @property
+    def enabled(self):
+        return self.events is not None
+
+    def enable(self):
+        with self.lock:
+            self.events = []
+            self.tracks = set()
+            self.dropped = 0
+            self.start = time.perf_counter()
+
+    def track(self):
+
+        """
+        :return: id and name of the current asyncio task, or of the current thread
+        :rtype: tuple
+        """
+
+        # no task can run unless asyncio has been imported, i.e. with -a
+        asyncio = sys.modules.get('asyncio')
+        try:
+            task = asyncio.current_task() if asyncio is not None else None
+        except RuntimeError:
+            task = None
+        if task is not None:
+            return id(task), task.get_name() if hasattr(task, 'get_name') else "task {}".format(id(task))
+        thread = threading.current_thread()
+        return thread.ident, thread.name
+
+    def record(self, name, start, end, args):
+        tid, track = self.track()
+        with self.lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            if tid not in self.tracks:
+                self.tracks.add(tid)
+                self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                                    'args': {'name': track}})
+            self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                                'ts': (start - self.start) * 1000000, 'dur': (end - start) * 1000000,
+                                'args': args})
+
+    @contextmanager
+    def span(self, name, **args):
+
+        """
+        Time the block
+        :param name: i.e. build_alert
+        :type name: str
+        :param args: shown with the span, i.e. id of the DS incident
+        """
+
+        if self.events is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), args)
+
+    def spans(self, name, iterable, **args):
+
+        """
+        Time each item of `iterable`, i.e. each page of a DS search
+        :rtype: generator
+        """
+
+        if self.events is None:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(name, start, time.perf_counter(), args)
+            yield item
+
+    async def async_spans(self, name, iterable, **args):
+
+        """
+        spans() for async iterables
+        :rtype: async generator
+        """
+
+        iterator = iterable.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            if self.events is not None:
+                self.record(name, start, time.perf_counter(), args)
+            yield item
+
+    async def traced(self, name, coro, **args):
+
+        """
+        Time a coroutine scheduled as a task of its own
+        """
+
+        with self.span(name, **args):
+            return await coro
+
+    def write(self, path):
+
+        """
+        Write the spans as a Chrome trace
+        :param path: JSON file
+        :type path: str
+        """
+
+        with self.lock:
+            events = list(self.events or [])
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        logging.debug("Tracer.write(): {} spans written to {}, {} dropped".format(
+            len(events) - len(self.tracks), path, self.dropped))
+
+
+tracer = Tracer()